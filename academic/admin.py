@@ -1,6 +1,7 @@
 from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
 from django.contrib import admin
-from django.db.models import Q, F
+from django.db.models import Q
+from django.db.models.functions import Mod
 from django.db.models.query import QuerySet
 from django.http import HttpResponseRedirect
 from django.http.request import HttpRequest
@@ -14,9 +15,18 @@ from import_export.admin import ImportExportModelAdmin
 from . import models
 from . import forms
 from . import mixins
+from . import resources
+
+class SkalaNilaiInline(admin.TabularInline):
+    extra = 0
+    model = models.SkalaNilai
+    fields = ['huruf_mutu', 'angka_mutu', 'nilai_minimum']
+    ordering = ['-nilai_minimum']
+
 
 @admin.register(models.Kurikulum)
 class KurikulumAdmin(admin.ModelAdmin):
+    inlines = [SkalaNilaiInline]
     list_display = ['kode', 'nama', 'tanggal_digunakan']
 
 
@@ -29,8 +39,8 @@ class UptTIKAdmin(admin.ModelAdmin):
     
     def get_queryset(self, request):
         if hasattr(request.user, 'upttik'):
-            return models.UptTIK.objects.filter(user_id=request.user.id)
-        return super().get_queryset(request)
+            return models.UptTIK.objects.with_user_fields().filter(user_id=request.user.id)
+        return super().get_queryset(request).with_user_fields()
     
     def has_add_permission(self, request):
         if self.isUptTIKUser(request):
@@ -161,11 +171,14 @@ class StaffProdiAdmin(admin.ModelAdmin):
     autocomplete_fields = ['prodi', 'user']
     list_display = ['no_induk', 'nama', 'email', 'username']
     list_per_page = 10
-    list_select_related = ['user']
     search_fields = ['user__first_name']
 
+    @admin.display(ordering='user_first_name')
     def nama(self, staff_prodi):
-        return f'{staff_prodi.user.first_name} {staff_prodi.user.last_name}'
+        return staff_prodi.nama_lengkap()
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_user_fields()
     
     def changelist_view(self, request, extra_context=None):
         if hasattr(request.user, 'staffprodi'):
@@ -272,7 +285,7 @@ class MahasiswaAdmin(admin.ModelAdmin):
     list_display = ['nim', 'nama', 'username', 'kelas']
     list_filter = [MahasiswaFilter]
     list_per_page = 10
-    search_fields = ['nama']
+    search_fields = ['nim', 'user__first_name', 'user__last_name']
     readonly_fields = ['preview']
 
     def preview(self, mahasiswa):
@@ -280,22 +293,23 @@ class MahasiswaAdmin(admin.ModelAdmin):
             return format_html(f'<img class="thumbnail" src="/media/{mahasiswa.foto_profil}" />')
         return None
 
+    @admin.display(ordering='user_first_name')
     def nama(self, mahasiswa):
-        return f'{mahasiswa.user.first_name} {mahasiswa.user.last_name}'
+        return mahasiswa.nama_lengkap()
 
+    @admin.display(ordering='user_username')
     def username(self, mahasiswa):
-        return mahasiswa.user.username
+        return mahasiswa.username()
 
     def get_queryset(self, request):
+        queryset = models.Mahasiswa.objects.with_user_fields().select_related('kelas__prodi', 'kelas__semester')
         if hasattr(request.user, 'staffprodi'):
             prodi = request.user.staffprodi.prodi
-            return models.Mahasiswa.objects.filter(kelas__prodi=prodi)
+            return queryset.filter(kelas__prodi=prodi)
         elif hasattr(request.user, 'dosen'):
             dosen = request.user.dosen
-            jadwal_dosen = list(models.JadwalMakul.objects.filter(dosen=dosen))
-            jadwal_dosen_kelas_id = [jadwal_makul.jadwal.kelas.id for jadwal_makul in jadwal_dosen]
-            return models.Mahasiswa.objects.filter(kelas_id__in=jadwal_dosen_kelas_id)
-        return super().get_queryset(request)
+            return queryset.filter(kelas__jadwal_list__makul_list__dosen=dosen).distinct()
+        return queryset
 
     class Media:
         css = {
@@ -383,13 +397,15 @@ class KaryaIlmiahAdmin(admin.ModelAdmin):
 class MataKuliahInline(admin.TabularInline):
     model = models.JadwalMakul
     extra = 0
+    formset = forms.JadwalMakulInlineFormset
     fields = ['mata_kuliah', 'ruangan', 'dosen',
               'hari', 'jam_mulai', 'jam_selesai']
     autocomplete_fields = ['mata_kuliah', 'ruangan', 'dosen']
     
 
 @admin.register(models.Jadwal)
-class JadwalAdmin(admin.ModelAdmin):
+class JadwalAdmin(ImportExportModelAdmin, admin.ModelAdmin):
+    resource_classes = [resources.JadwalResource]
     autocomplete_fields = ['kelas']
     inlines = [MataKuliahInline]
     list_display = ['id', 'kelas', 'nama_kurikulum']
@@ -414,11 +430,16 @@ class SemesterTypeFilter(admin.SimpleListFilter):
         ]
     
     def queryset(self, request: Any, queryset: QuerySet[Any]) -> QuerySet[Any] | None:
-        if self.value() == 'odd':
-            return queryset.annotate(odd=F('semester') % 2).filter(odd=True)
-        elif self.value() == 'even':
-            return queryset.annotate(odd=F('semester') % 2).filter(odd=False)
-        return queryset
+        # 'MataKuliah.semester' is a plain number, so the parity comes from the 'Semester' table, and from
+        # the number itself for the semesters that have no row there
+        if self.value() not in ['odd', 'even']:
+            return queryset
+        ganjil = self.value() == 'odd'
+        semester_list = models.Semester.objects.values('no')
+        return queryset.alias(semester_mod=Mod('semester', 2)).filter(
+            Q(semester__in=semester_list.filter(ganjil=ganjil)) |
+            (~Q(semester__in=semester_list) & Q(semester_mod=1 if ganjil else 0))
+        )
         
 
 @admin.register(models.MataKuliah)
@@ -486,7 +507,7 @@ class KHSAdmin(admin.ModelAdmin):
     autocomplete_fields = ['mahasiswa']
     fields = ['mahasiswa', 'tahun_akademik_awal', 'tahun_akademik_akhir', 'semester']
     inlines = [NilaiKHSInline]
-    list_display = ['mahasiswa', 'semester', 'tahun_akademik', 'kelas']
+    list_display = ['mahasiswa', 'semester', 'tahun_akademik', 'kelas', 'ips']
     list_filter = ['semester', 'kelas']
     search_fields = ['mahasiswa__nim', 'tahun_akademik_awal', 'tahun_akademik_akhir']
     change_form_template = "khs_change_form.html"
@@ -524,7 +545,8 @@ class KoordinatorProgramStudiAdmin(admin.ModelAdmin):
 
 
 @admin.register(models.JadwalMakul)
-class JadwalMakulAdmin(admin.ModelAdmin):
+class JadwalMakulAdmin(ImportExportModelAdmin, admin.ModelAdmin):
+    resource_classes = [resources.JadwalMakulResource]
     search_fields = ['kelas__prodi, kelas__semester, mata_kuliah__nama']
 
     def get_search_results(self, request: HttpRequest, queryset: QuerySet[Any], search_term: str) -> Tuple[QuerySet[Any], bool]:
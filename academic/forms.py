@@ -1,36 +1,16 @@
 from typing import Any
 from django import forms
 from django.contrib.auth import get_user_model
+from django.db.models import Q
 
-from . import models
+from . import models, scheduling
+from .grading import get_grading_scale
 
 
 class NilaiKHSInlineFormset(forms.models.BaseInlineFormSet):
-    def get_huruf_mutu(self, nilai):
-        if nilai > 80:
-            return "A"
-        elif nilai > 70:
-            return "B"
-        elif nilai > 60:
-            return "C"
-        elif nilai > 50:
-            return "D"
-        else:
-            return "E"
-        
-    def get_angka_mutu(self, nilai):
-        if nilai > 80:
-            return 4
-        elif nilai > 70:
-            return 3
-        elif nilai > 60:
-            return 2
-        else:
-            return 1
-        
     def set_auto_populated_attribute(self, obj, commit):
-        obj.huruf_mutu = self.get_huruf_mutu(obj.nilai)
-        obj.angka_mutu = self.get_angka_mutu(obj.nilai)
+        scale = get_grading_scale(obj.mata_kuliah.kurikulum_id)
+        obj.huruf_mutu, obj.angka_mutu = scale.convert(obj.nilai)
         
         #TODO: Violate the Single Responsibility Principle, Refactor it in the future
         if commit:
@@ -47,6 +27,44 @@ class NilaiKHSInlineFormset(forms.models.BaseInlineFormSet):
         return self.set_auto_populated_attribute(obj, commit)
 
 
+class JadwalMakulInlineFormset(forms.models.BaseInlineFormSet):
+    def clean(self):
+        super().clean()
+        bookings = []
+        for form in self.forms:
+            if not hasattr(form, 'cleaned_data') or not form.cleaned_data or self._should_delete_form(form):
+                continue
+            data = form.cleaned_data
+            if not data.get('jam_mulai') or not data.get('jam_selesai'):
+                continue
+            if data['jam_mulai'] >= data['jam_selesai']:
+                form.add_error('jam_selesai', '"jam_selesai" should be later than "jam_mulai"')
+                continue
+            bookings.append((form, {
+                'id': form.instance.id,
+                'hari': data.get('hari'),
+                'jam_mulai': data['jam_mulai'],
+                'jam_selesai': data['jam_selesai'],
+                'ruangan_id': getattr(data.get('ruangan'), 'id', None),
+                'dosen_id': getattr(data.get('dosen'), 'id', None),
+                # A new 'jadwal' has no id yet, its rows still can't overlap each other
+                'jadwal_id': self.instance.id or 'new'
+            }))
+
+        # Bookings of the other 'jadwal' that share a 'ruangan' or a 'dosen' with this one
+        ruangan_ids = {booking['ruangan_id'] for form, booking in bookings}
+        dosen_ids = {booking['dosen_id'] for form, booking in bookings if booking['dosen_id']}
+        index = scheduling.ScheduleIndex.from_queryset(
+            models.JadwalMakul.objects\
+                .filter(Q(ruangan_id__in=ruangan_ids) | Q(dosen_id__in=dosen_ids))\
+                .exclude(jadwal_id=self.instance.id)
+        )
+        for form, booking in bookings:
+            for conflict in index.conflicts(booking):
+                form.add_error(None, scheduling.describe_conflict(conflict))
+            index.add(booking)
+
+
 class UserDosenAdminForm(forms.ModelForm):
     class Meta:
         model = get_user_model()
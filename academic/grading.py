@@ -0,0 +1,86 @@
+from bisect import bisect_right
+from decimal import Decimal
+from django.db.models import Case, Value, When
+
+from . import models
+
+# (huruf_mutu, angka_mutu, nilai_minimum), used by every 'kurikulum' without its own 'SkalaNilai'.
+DEFAULT_SKALA_NILAI = [
+    ('A', 4, Decimal(80)),
+    ('B', 3, Decimal(70)),
+    ('C', 2, Decimal(60)),
+    ('D', 1, Decimal(50)),
+    ('E', 0, Decimal(0)),
+]
+
+
+class GradingScale:
+    '''
+    Converts scores ('nilai') to 'huruf_mutu' and 'angka_mutu'. The same table can be
+    applied to one score, to a list of scores, or turned into database expressions so
+    a whole set of 'NilaiKHS' is regraded with a single UPDATE.
+    '''
+    def __init__(self, grades):
+        self.grades = sorted(grades, key=lambda grade: grade[2])
+        self.cutoffs = [grade[2] for grade in self.grades]
+
+    def convert(self, nilai):
+        index = max(bisect_right(self.cutoffs, nilai) - 1, 0)
+        huruf_mutu, angka_mutu, nilai_minimum = self.grades[index]
+        return huruf_mutu, angka_mutu
+
+    def convert_many(self, nilai_list):
+        return [self.convert(nilai) for nilai in nilai_list]
+
+    def as_expression(self, index, field='nilai'):
+        ''' Returns a CASE expression giving the 'huruf_mutu' (index 0) or 'angka_mutu' (index 1) of 'field'. '''
+        return Case(
+            *[
+                When(**{f'{field}__gte': grade[2]}, then=Value(grade[index]))
+                for grade in reversed(self.grades)
+            ],
+            default=Value(self.grades[0][index])
+        )
+
+    def huruf_mutu_expression(self, field='nilai'):
+        return self.as_expression(0, field)
+
+    def angka_mutu_expression(self, field='nilai'):
+        return self.as_expression(1, field)
+
+
+def get_grading_scales(kurikulum_ids):
+    ''' Loads the grading scale of every given 'kurikulum' with one query. '''
+    grades = {}
+    for skala_nilai in models.SkalaNilai.objects.filter(kurikulum_id__in=[kurikulum_id for kurikulum_id in kurikulum_ids if kurikulum_id]):
+        grades.setdefault(skala_nilai.kurikulum_id, []).append(
+            (skala_nilai.huruf_mutu, skala_nilai.angka_mutu, skala_nilai.nilai_minimum)
+        )
+    default = GradingScale(DEFAULT_SKALA_NILAI)
+    return {
+        kurikulum_id: GradingScale(grades[kurikulum_id]) if kurikulum_id in grades else default
+        for kurikulum_id in kurikulum_ids
+    }
+
+
+def get_grading_scale(kurikulum_id):
+    return get_grading_scales([kurikulum_id])[kurikulum_id]
+
+
+def regrade_nilai_khs(nilai_khs_list):
+    '''
+    Recalculates 'huruf_mutu' and 'angka_mutu' of a 'NilaiKHS' queryset in the database,
+    with one UPDATE for every 'kurikulum' the courses belong to. Returns the affected 'KHS' ids.
+    '''
+    kurikulum_ids = set(nilai_khs_list.order_by().values_list('mata_kuliah__kurikulum_id', flat=True).distinct())
+    khs_ids = set(nilai_khs_list.order_by().values_list('khs_id', flat=True).distinct())
+    for kurikulum_id, scale in get_grading_scales(kurikulum_ids).items():
+        if kurikulum_id:
+            queryset = nilai_khs_list.filter(mata_kuliah__kurikulum_id=kurikulum_id)
+        else:
+            queryset = nilai_khs_list.filter(mata_kuliah__kurikulum__isnull=True)
+        queryset.update(
+            huruf_mutu=scale.huruf_mutu_expression(),
+            angka_mutu=scale.angka_mutu_expression()
+        )
+    return khs_ids
@@ -0,0 +1,54 @@
+from django.core.cache import cache
+
+from . import models, serializers
+
+# The payload holds names of related rows (dosen, ruangan, mata_kuliah) that don't invalidate it,
+# so it also expires on its own
+CACHE_TIMEOUT = 60 * 60 * 6
+
+DAYS = [hari for hari, nama in models.JadwalMakul.HARI_CHOICES]
+
+
+def get_kelas_key(kelas_id, hari):
+    return f'academic:jadwal_kelas:{kelas_id}:{hari}'
+
+
+def get_mahasiswa_key(user_id):
+    return f'academic:mahasiswa_kelas:{user_id}'
+
+
+def get_jadwal_kelas(kelas_id, hari):
+    '''
+    Returns the serialized 'JadwalMakul' of a 'kelas' on a day. The payload is built once and
+    served from the cache until a 'JadwalMakul' or 'Materi' of the 'kelas' changes.
+    '''
+    key = get_kelas_key(kelas_id, hari)
+    data = cache.get(key)
+    if data is None:
+        queryset = models.JadwalMakul.objects\
+            .filter(jadwal__kelas_id=kelas_id, hari=hari)\
+            .select_related('dosen', 'ruangan__gedung', 'mata_kuliah')\
+            .prefetch_related('materi_set')\
+            .order_by('jam_mulai')
+        data = serializers.JadwalMakulSerializer(queryset, many=True).data
+        cache.set(key, data, CACHE_TIMEOUT)
+    return data
+
+
+def get_mahasiswa_kelas_id(user_id):
+    ''' Returns the 'kelas' id of the 'mahasiswa' of a user, or None when the user isn't a 'mahasiswa'. '''
+    key = get_mahasiswa_key(user_id)
+    kelas_id = cache.get(key)
+    if kelas_id is None:
+        kelas_id = models.Mahasiswa.objects.filter(user_id=user_id).values_list('kelas_id', flat=True).first()
+        if kelas_id is not None:
+            cache.set(key, kelas_id, CACHE_TIMEOUT)
+    return kelas_id
+
+
+def invalidate_jadwal_kelas(kelas_ids):
+    cache.delete_many([get_kelas_key(kelas_id, hari) for kelas_id in kelas_ids for hari in DAYS])
+
+
+def invalidate_mahasiswa_kelas(user_id):
+    cache.delete(get_mahasiswa_key(user_id))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from academic import scheduling
+
+
+class Command(BaseCommand):
+    help = 'Checks the whole timetable for ruangan, dosen and kelas booked twice at overlapping hours'
+
+    def handle(self, *args, **options):
+        conflicts = scheduling.audit(scheduling.load_bookings())
+        for conflict in conflicts:
+            self.stdout.write(scheduling.describe_conflict(conflict))
+
+        if conflicts:
+            self.stdout.write(self.style.ERROR(f'{len(conflicts)} conflicts found'))
+        else:
+            self.stdout.write(self.style.SUCCESS('No conflicts found'))
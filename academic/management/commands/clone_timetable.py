@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from academic import models, timetable
+
+
+def parse_pairs(values):
+    try:
+        return dict(tuple(int(pair_id) for pair_id in value.split(':')) for value in values or [])
+    except ValueError:
+        raise CommandError(f'Expected pairs of ids like "12:34", got {" ".join(values)}')
+
+
+def check_ids(model, pairs):
+    ids = set(pairs) | set(pairs.values())
+    missing = ids - set(model.objects.filter(id__in=ids).values_list('id', flat=True))
+    if missing:
+        raise CommandError(f'{model.__name__} {", ".join(map(str, sorted(missing)))} not found')
+
+
+class Command(BaseCommand):
+    help = 'Copies the jadwal makul of kelas to other kelas, optionally swapping dosen and ruangan'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--kelas', nargs='+', required=True, help='Source and target kelas id pairs, e.g. 12:34')
+        parser.add_argument('--dosen', nargs='+', help='Old and new dosen id pairs')
+        parser.add_argument('--ruangan', nargs='+', help='Old and new ruangan id pairs')
+        parser.add_argument('--replace', action='store_true', help='Delete the jadwal makul of the target kelas first')
+        parser.add_argument('--move', action='store_true', help='Delete the jadwal makul of the source kelas')
+
+    def handle(self, *args, **options):
+        kelas_map = parse_pairs(options['kelas'])
+        dosen_map = parse_pairs(options['dosen'])
+        ruangan_map = parse_pairs(options['ruangan'])
+        if set(kelas_map) & set(kelas_map.values()):
+            raise CommandError('A kelas can\'t be both a source and a target')
+        check_ids(models.Kelas, kelas_map)
+        check_ids(models.Dosen, dosen_map)
+        check_ids(models.Ruangan, ruangan_map)
+        try:
+            created = timetable.clone_jadwal(kelas_map, dosen_map, ruangan_map, options['replace'], options['move'])
+        except ValueError as error:
+            raise CommandError(str(error))
+        self.stdout.write(self.style.SUCCESS(f'{len(created)} jadwal makul created'))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from academic import models
+from academic.utils import generate_khs
+
+
+class Command(BaseCommand):
+    help = 'Creates the KHS of every mahasiswa in the given kelas (all kelas by default) for an academic year'
+
+    def add_arguments(self, parser):
+        parser.add_argument('tahun_akademik_awal', type=int)
+        parser.add_argument('tahun_akademik_akhir', type=int)
+        parser.add_argument('--kelas', type=int, nargs='+', help='The id of the kelas')
+
+    def handle(self, *args, **options):
+        kelas_ids = options['kelas'] or list(models.Kelas.objects.values_list('id', flat=True))
+        created = generate_khs(kelas_ids, options['tahun_akademik_awal'], options['tahun_akademik_akhir'])
+        self.stdout.write(self.style.SUCCESS(f'{created} KHS created'))
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from academic import models, timetable
+
+
+class Command(BaseCommand):
+    help = 'Schedules the mata kuliah of the given kelas (all kelas by default) that have no jadwal makul yet'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--kelas', type=int, nargs='+', help='The id of the kelas')
+        parser.add_argument('--prodi', help='The kode of the program studi')
+        parser.add_argument('--ruangan', type=int, nargs='+', help='The id of the ruangan that can be used')
+        parser.add_argument('--time-budget', type=int, default=60, help='Seconds the search may take')
+        parser.add_argument('--workers', type=int, default=1, help='Number of processes searching with different seeds')
+        parser.add_argument('--partial', action='store_true', help='Save the best partial timetable when no complete one is found')
+
+    def handle(self, *args, **options):
+        kelas = models.Kelas.objects.all()
+        if options['kelas']:
+            kelas = kelas.filter(id__in=options['kelas'])
+        if options['prodi']:
+            kelas = kelas.filter(prodi__kode=options['prodi'])
+        kelas_ids = list(kelas.values_list('id', flat=True))
+
+        problem = timetable.build_problem(kelas_ids, options['ruangan'])
+        if not problem['tasks']:
+            self.stdout.write('Nothing to schedule')
+            return
+
+        assignments, complete = timetable.generate(problem, options['time_budget'], options['workers'])
+        if not complete and not options['partial']:
+            raise CommandError(
+                f'No complete timetable found within {options["time_budget"]} seconds, '
+                f'the best one schedules {len(assignments)} of {len(problem["tasks"])} mata kuliah'
+            )
+
+        try:
+            created = timetable.save_assignments(assignments)
+        except ValueError as error:
+            raise CommandError(str(error))
+        self.stdout.write(self.style.SUCCESS(f'{len(created)} of {len(problem["tasks"])} jadwal makul created'))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from academic import models
+from academic.grading import regrade_nilai_khs
+from academic.utils import invalidate_khs_pdf_cache, refresh_khs_totals
+
+
+class Command(BaseCommand):
+    help = 'Recalculates huruf_mutu and angka_mutu of every NilaiKHS in an academic year using the current grading scales'
+
+    def add_arguments(self, parser):
+        parser.add_argument('tahun_akademik_awal', type=int)
+        parser.add_argument('--semester', type=int)
+
+    def handle(self, *args, **options):
+        nilai_khs_list = models.NilaiKHS.objects.filter(khs__tahun_akademik_awal=options['tahun_akademik_awal'])
+        if options['semester']:
+            nilai_khs_list = nilai_khs_list.filter(khs__semester=options['semester'])
+
+        with transaction.atomic():
+            khs_ids = regrade_nilai_khs(nilai_khs_list)
+            refresh_khs_totals(khs_ids)
+
+        for khs_id in khs_ids:
+            invalidate_khs_pdf_cache(khs_id)
+        self.stdout.write(self.style.SUCCESS(f'{len(khs_ids)} KHS regraded'))
@@ -0,0 +1,58 @@
+# Generated by Django 4.2.3 on 2026-10-17 09:12
+
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import Count, F, Sum
+
+
+def calculate_khs_totals(apps, schema_editor):
+    ''' The IPS is SKS-weighted, the 'nilai mutu' total divided by the SKS total. '''
+    KHS = apps.get_model('academic', 'KHS')
+    NilaiKHS = apps.get_model('academic', 'NilaiKHS')
+    sks = F('mata_kuliah__jumlah_sks_teori') + F('mata_kuliah__jumlah_sks_praktik')
+    totals = NilaiKHS.objects\
+        .values('khs_id')\
+        .annotate(
+            total_sks=Sum(sks),
+            total_nilai_mutu=Sum(F('angka_mutu') * sks),
+            jumlah_mata_kuliah=Count('id')
+        )
+    for total in totals:
+        ips = total['total_nilai_mutu'] / total['total_sks'] if total['total_sks'] else 0
+        KHS.objects.filter(pk=total['khs_id']).update(
+            ips=Decimal(str(round(ips, 2))),
+            total_sks=total['total_sks'],
+            total_nilai_mutu=total['total_nilai_mutu'],
+            jumlah_mata_kuliah=total['jumlah_mata_kuliah']
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('academic', '0086_alter_nilaikhs_options_materi'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='khs',
+            name='ips',
+            field=models.DecimalField(db_index=True, decimal_places=2, default=0, max_digits=3),
+        ),
+        migrations.AddField(
+            model_name='khs',
+            name='jumlah_mata_kuliah',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='khs',
+            name='total_nilai_mutu',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='khs',
+            name='total_sks',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(calculate_khs_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.3 on 2026-10-17 10:05
+
+import django.core.validators
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('academic', '0087_khs_ips_khs_jumlah_mata_kuliah_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SkalaNilai',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('huruf_mutu', models.CharField(max_length=1)),
+                ('angka_mutu', models.IntegerField(validators=[django.core.validators.MinValueValidator(0), django.core.validators.MaxValueValidator(4)])),
+                ('nilai_minimum', models.DecimalField(decimal_places=2, max_digits=6, validators=[django.core.validators.MinValueValidator(0), django.core.validators.MaxValueValidator(100)])),
+                ('kurikulum', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='skala_nilai_list', to='academic.kurikulum')),
+            ],
+            options={
+                'verbose_name_plural': 'Skala Nilai',
+                'unique_together': {('kurikulum', 'huruf_mutu')},
+            },
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.2.3 on 2026-10-17 11:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('academic', '0088_skalanilai'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='khs',
+            index=models.Index(fields=['program_studi', 'semester', 'kelas'], name='academic_kh_program_acc94f_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='khs',
+            index=models.Index(fields=['semester'], name='academic_kh_semeste_746bcc_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='khs',
+            index=models.Index(fields=['tahun_akademik_awal', 'tahun_akademik_akhir', 'semester'], name='academic_kh_tahun_a_a17c52_idx'),
+        ),
+    ]
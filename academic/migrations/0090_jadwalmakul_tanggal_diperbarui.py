@@ -0,0 +1,20 @@
+# Generated by Django 4.2.3 on 2026-10-17 13:20
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('academic', '0089_khs_academic_kh_program_acc94f_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='jadwalmakul',
+            name='tanggal_diperbarui',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+    ]
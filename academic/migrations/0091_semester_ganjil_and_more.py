@@ -0,0 +1,40 @@
+# Generated by Django 4.2.3 on 2026-10-17 14:05
+
+from django.db import migrations, models
+import django.db.models.functions.math
+import django.db.models.lookups
+
+
+def set_ganjil(apps, schema_editor):
+    Semester = apps.get_model('academic', 'Semester')
+    semester_list = Semester.objects.alias(mod=django.db.models.functions.math.Mod('no', 2))
+    semester_list.filter(mod=0).update(ganjil=False)
+    semester_list.filter(mod=1).update(ganjil=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('academic', '0090_jadwalmakul_tanggal_diperbarui'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='semester',
+            name='ganjil',
+            field=models.BooleanField(default=True, editable=False),
+        ),
+        migrations.RunPython(set_ganjil, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='semester',
+            index=models.Index(fields=['ganjil', 'no'], name='academic_se_ganjil_b63b2c_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='semester',
+            constraint=models.CheckConstraint(check=models.Q(models.Q(django.db.models.lookups.Exact(django.db.models.functions.math.Mod('no', 2), 1), ('ganjil', True)), models.Q(django.db.models.lookups.Exact(django.db.models.functions.math.Mod('no', 2), 0), ('ganjil', False)), _connector='OR'), name='academic_semester_ganjil_parity'),
+        ),
+        migrations.AddIndex(
+            model_name='matakuliah',
+            index=models.Index(fields=['program_studi', 'semester'], name='academic_ma_program_331e97_idx'),
+        ),
+    ]
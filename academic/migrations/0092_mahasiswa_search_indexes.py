@@ -0,0 +1,39 @@
+# Generated by Django 4.2.3 on 2026-10-17 16:20
+
+from django.conf import settings
+from django.db import migrations
+
+# The unique nim already has the 'varchar_pattern_ops' index Django adds on PostgreSQL for the
+# prefix matches, the names need trigram indexes on the table of 'AUTH_USER_MODEL'
+TRIGRAM_INDEXES = {
+    'academic_user_first_name_trgm': 'first_name',
+    'academic_user_last_name_trgm': 'last_name',
+}
+
+
+def create_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    table = schema_editor.quote_name(apps.get_model(settings.AUTH_USER_MODEL)._meta.db_table)
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for name, column in TRIGRAM_INDEXES.items():
+        schema_editor.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {table} USING gin ({column} gin_trgm_ops)')
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name in TRIGRAM_INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('academic', '0091_semester_ganjil_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
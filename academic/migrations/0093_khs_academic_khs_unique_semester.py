@@ -0,0 +1,52 @@
+# Generated by Django 4.2.3 on 2026-10-17 19:05
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def remove_empty_duplicates(apps, schema_editor):
+    '''
+    Concurrent generation runs could create the same 'KHS' twice. Of every group of copies the one
+    with 'NilaiKHS' is kept, or the oldest one when none has scores, and the empty ones are deleted.
+    Copies that both have scores have to be merged by hand first, their ids are listed in the error.
+    '''
+    KHS = apps.get_model('academic', 'KHS')
+    NilaiKHS = apps.get_model('academic', 'NilaiKHS')
+    duplicates = KHS.objects\
+        .values('mahasiswa_id', 'semester', 'tahun_akademik_awal')\
+        .annotate(jumlah=Count('id'))\
+        .filter(jumlah__gt=1)
+    scored_khs = set(NilaiKHS.objects.values_list('khs_id', flat=True).distinct())
+
+    to_merge = []
+    for duplicate in duplicates:
+        khs_ids = sorted(KHS.objects.filter(**{
+            field: duplicate[field] for field in ['mahasiswa_id', 'semester', 'tahun_akademik_awal']
+        }).values_list('id', flat=True))
+        scored_ids = [khs_id for khs_id in khs_ids if khs_id in scored_khs]
+        if len(scored_ids) > 1:
+            to_merge.append(scored_ids)
+            continue
+        keep_id = scored_ids[0] if scored_ids else khs_ids[0]
+        KHS.objects.filter(id__in=khs_ids).exclude(id=keep_id).delete()
+
+    if to_merge:
+        raise RuntimeError(
+            'These KHS are duplicates that all have scores, merge them before migrating: ' +
+            '; '.join(', '.join(map(str, khs_ids)) for khs_ids in to_merge)
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('academic', '0092_mahasiswa_search_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_empty_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='khs',
+            constraint=models.UniqueConstraint(fields=('mahasiswa', 'semester', 'tahun_akademik_awal'), name='academic_khs_unique_semester'),
+        ),
+    ]
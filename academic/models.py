@@ -1,6 +1,43 @@
 from django.conf import settings
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.db import models
+from django.db.models.functions import Mod
+from django.db.models.lookups import Exact
+
+
+class UserFieldsQuerySet(models.QuerySet):
+    def with_user_fields(self):
+        ''' Annotates the name, email and username of the 'user', so reading them doesn't query per row. '''
+        return self.annotate(
+            user_first_name=models.F('user__first_name'),
+            user_last_name=models.F('user__last_name'),
+            user_email=models.F('user__email'),
+            user_username=models.F('user__username'),
+        )
+
+
+class UserFieldsMixin:
+    def get_user_field(self, field):
+        # The 'user' when it was loaded or assigned, since it's the newer value, then the annotation of
+        # 'with_user_fields' when the row was loaded with it, and a query for the 'user' otherwise
+        if f'user_{field}' in self.__dict__ and not type(self).user.is_cached(self):
+            return self.__dict__[f'user_{field}']
+        return getattr(self.user, field)
+
+    def nama_depan(self):
+        return self.get_user_field('first_name')
+
+    def nama_belakang(self):
+        return self.get_user_field('last_name')
+
+    def email(self):
+        return self.get_user_field('email')
+
+    def username(self):
+        return self.get_user_field('username')
+
+    def nama_lengkap(self):
+        return f'{self.nama_depan()} {self.nama_belakang()}'
 
 
 class Kurikulum(models.Model):
@@ -15,6 +52,25 @@ class Kurikulum(models.Model):
         verbose_name_plural = 'Kurikulum'
 
 
+class SkalaNilai(models.Model):
+    ''' 
+    A row of the grading scale used by a 'kurikulum'. A score gets the 'huruf_mutu' of the
+    highest row whose 'nilai_minimum' it reaches. When a 'kurikulum' has no rows,
+    'grading.DEFAULT_SKALA_NILAI' is used.
+    '''
+    kurikulum = models.ForeignKey(Kurikulum, on_delete=models.CASCADE, related_name='skala_nilai_list')
+    huruf_mutu = models.CharField(max_length=1)
+    angka_mutu = models.IntegerField(validators=[MinValueValidator(0), MaxValueValidator(4)])
+    nilai_minimum = models.DecimalField(validators=[MinValueValidator(0), MaxValueValidator(100)], max_digits=6, decimal_places=2)
+
+    def __str__(self) -> str:
+        return self.huruf_mutu
+
+    class Meta:
+        unique_together = ['kurikulum', 'huruf_mutu']
+        verbose_name_plural = 'Skala Nilai'
+
+
 class Jurusan(models.Model):
     nama = models.CharField(max_length=255)
 
@@ -25,13 +81,35 @@ class Jurusan(models.Model):
         verbose_name_plural = 'Jurusan'
     
 
+class SemesterQuerySet(models.QuerySet):
+    def bulk_create(self, objs, *args, **kwargs):
+        # 'bulk_create' skips 'save()', the check constraint rejects a wrong 'ganjil'
+        for semester in objs:
+            semester.ganjil = semester.no % 2 == 1
+        return super().bulk_create(objs, *args, **kwargs)
+
+
 class Semester(models.Model):
     no = models.PositiveSmallIntegerField(primary_key=True, validators=[MinValueValidator(1)])
+    ganjil = models.BooleanField(default=True, editable=False)
+
+    objects = SemesterQuerySet.as_manager()
+
+    def save(self, *args, **kwargs):
+        self.ganjil = self.no % 2 == 1
+        return super().save(*args, **kwargs)
 
     def __str__(self) -> str:
         return str(self.no)
     
     class Meta:
+        indexes = [models.Index(fields=['ganjil', 'no'])]
+        constraints = [
+            models.CheckConstraint(
+                check=models.Q(Exact(Mod('no', 2), 1), ganjil=True) | models.Q(Exact(Mod('no', 2), 0), ganjil=False),
+                name='academic_semester_ganjil_parity'
+            )
+        ]
         verbose_name_plural = 'Semester'
     
 
@@ -73,13 +151,15 @@ class Pemberitahuan(models.Model):
         verbose_name_plural = 'Pemberitahuan'
 
 
-class UptTIK(models.Model):
+class UptTIK(UserFieldsMixin, models.Model):
     no_induk = models.CharField(max_length=20, unique=True)
     no_hp = models.CharField(max_length=13)
     user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
 
+    objects = UserFieldsQuerySet.as_manager()
+
     def __str__(self) -> str:
-        return f'{self.user.first_name} {self.user.last_name}'
+        return self.nama_lengkap()
     
     class Meta:
         verbose_name_plural = 'UPT TIK'
@@ -102,26 +182,16 @@ class ProgramStudi(models.Model):
         verbose_name_plural = 'Program Studi'
     
     
-class StaffProdi(models.Model):
+class StaffProdi(UserFieldsMixin, models.Model):
     no_induk = models.CharField(max_length=20, unique=True)
     no_hp = models.CharField(max_length=255)
     prodi = models.ForeignKey(ProgramStudi, on_delete=models.CASCADE)
     user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
 
-    def nama_depan(self):
-        return self.user.first_name
-    
-    def nama_belakang(self):
-        return self.user.last_name
-    
-    def username(self):
-        return self.user.username
-    
-    def email(self):
-        return self.user.email
+    objects = UserFieldsQuerySet.as_manager()
     
     def __str__(self) -> str:
-        return f'{self.user.first_name} {self.user.last_name}'
+        return self.nama_lengkap()
     
     class Meta:
         verbose_name_plural = 'Staff Prodi'
@@ -162,7 +232,7 @@ class Kelas(models.Model):
         verbose_name_plural = 'Kelas'
 
 
-class Mahasiswa(models.Model):
+class Mahasiswa(UserFieldsMixin, models.Model):
     nim = models.CharField(max_length=10, unique=True)
     tanggal_lahir = models.DateField()
     no_hp = models.CharField(max_length=13, null=True)
@@ -173,21 +243,11 @@ class Mahasiswa(models.Model):
     kelas = models.ForeignKey(Kelas, on_delete=models.PROTECT, related_name='mahasiswa_list')
     user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
 
+    objects = UserFieldsQuerySet.as_manager()
+
     def __str__(self) -> str:
         return self.nim
 
-    def nama_depan(self):
-        return self.user.first_name
-    
-    def nama_belakang(self):
-        return self.user.last_name
-    
-    def email(self):
-        return self.user.email
-    
-    def username(self):
-        return self.user.username
-
     class Meta:
         verbose_name_plural = 'Mahasiswa'
     
@@ -294,6 +354,7 @@ class MataKuliah(models.Model):
         return self.nama
 
     class Meta:
+        indexes = [models.Index(fields=['program_studi', 'semester'])]
         verbose_name_plural = 'Mata Kuliah'
 
     
@@ -318,6 +379,7 @@ class JadwalMakul(models.Model):
     dosen = models.ForeignKey(Dosen, on_delete=models.CASCADE, null=True, related_name='makul_ajar')
     ruangan = models.ForeignKey(Ruangan, on_delete=models.PROTECT)
     mata_kuliah = models.ForeignKey(MataKuliah, on_delete=models.CASCADE)
+    tanggal_diperbarui = models.DateTimeField(auto_now=True)
 
     def __str__(self) -> str:
         return f'{self.jadwal.kelas.prodi} {self.jadwal.kelas.semester} {self.jadwal.kelas.huruf} {self.mata_kuliah.nama}'
@@ -341,7 +403,24 @@ class KHS(models.Model):
     kelas = models.CharField(max_length=5)
     mahasiswa = models.ForeignKey(Mahasiswa, on_delete=models.CASCADE, related_name='khs_list')
 
+    # The fields below are aggregates of 'nilai_list'. They are kept up to date
+    # every time a 'NilaiKHS' is saved or deleted, see 'utils.refresh_khs_totals'.
+    ips = models.DecimalField(max_digits=3, decimal_places=2, default=0, db_index=True)
+    total_sks = models.PositiveIntegerField(default=0)
+    total_nilai_mutu = models.PositiveIntegerField(default=0)
+    jumlah_mata_kuliah = models.PositiveIntegerField(default=0)
+
     class Meta:
+        indexes = [
+            models.Index(fields=['program_studi', 'semester', 'kelas']),
+            models.Index(fields=['semester']),
+            models.Index(fields=['tahun_akademik_awal', 'tahun_akademik_akhir', 'semester']),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['mahasiswa', 'semester', 'tahun_akademik_awal'], name='academic_khs_unique_semester'
+            ),
+        ]
         verbose_name_plural = 'KHS'    
     
 
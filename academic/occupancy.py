@@ -0,0 +1,129 @@
+from django.core.cache import cache
+
+from . import models
+
+SLOT_MINUTES = 15
+SLOT_COUNT = 24 * 60 // SLOT_MINUTES
+
+
+def time_to_slot(value, round_up=False):
+    minutes = value.hour * 60 + value.minute + value.second / 60
+    slot = minutes / SLOT_MINUTES
+    slot = int(-(-slot // 1)) if round_up else int(slot // 1)
+    return min(slot, SLOT_COUNT)
+
+
+def get_mask(jam_mulai, jam_selesai):
+    ''' Returns the bits of the 15 minute slots touched by [jam_mulai, jam_selesai). '''
+    start = time_to_slot(jam_mulai)
+    end = time_to_slot(jam_selesai, round_up=True)
+    if end <= start:
+        return 0
+    return ((1 << (end - start)) - 1) << start
+
+
+class OccupancyCache:
+    '''
+    Keeps a bitmap of the booked 15 minute slots of every 'ruangan' and day, one Python int per
+    pair, in every worker. It is loaded with one query on first use. The save/delete signals publish
+    the id of every changed 'JadwalMakul' to the Django cache as a numbered change, and before
+    answering a worker reads the changed rows it hasn't seen yet by primary key and only sets and
+    clears their bits. Writers that skip the signals (bulk_create, bulk_update, imports) call
+    'invalidate', which bumps the version so every worker loads the bitmaps again.
+    '''
+    TIMEOUT = 60 * 60
+    VERSION_KEY = 'academic:occupancy_version'
+    CHANGE_KEY = 'academic:occupancy_change'
+    # Past this many unseen changes loading everything again is cheaper
+    MAX_CHANGES = 1000
+
+    def __init__(self):
+        self.version = None
+        self.change = None
+        self.bitmaps = None
+        self.keys = None
+        self.masks = None
+
+    def load(self, version, change):
+        self.bitmaps = {}
+        self.keys = {}
+        self.masks = {}
+        for booking in models.JadwalMakul.objects.values('id', 'ruangan_id', 'hari', 'jam_mulai', 'jam_selesai'):
+            self.add(booking)
+        self.version, self.change = version, change
+
+    def add(self, booking):
+        key = (booking['ruangan_id'], booking['hari'])
+        self.keys[booking['id']] = key
+        self.masks.setdefault(key, {})[booking['id']] = get_mask(booking['jam_mulai'], booking['jam_selesai'])
+        self.bitmaps[key] = self.bitmaps.get(key, 0) | self.masks[key][booking['id']]
+
+    def remove(self, jadwal_makul_id):
+        if jadwal_makul_id not in self.keys:
+            return
+        key = self.keys.pop(jadwal_makul_id)
+        self.masks[key].pop(jadwal_makul_id, None)
+        # Bookings can overlap when a conflict slipped in, so the bitmap is OR-ed again from the
+        # remaining bookings of the room and day instead of clearing the bits of the removed one
+        bitmap = 0
+        for mask in self.masks[key].values():
+            bitmap |= mask
+        if bitmap:
+            self.bitmaps[key] = bitmap
+        else:
+            self.bitmaps.pop(key, None)
+            self.masks.pop(key, None)
+
+    def apply_changes(self, change):
+        ''' Applies the changes published after the last one seen. Returns False when that isn't possible. '''
+        if change == self.change:
+            return True
+        if change < self.change or change - self.change > self.MAX_CHANGES:
+            return False
+        change_keys = [f'{self.CHANGE_KEY}:{number}' for number in range(self.change + 1, change + 1)]
+        changes = cache.get_many(change_keys)
+        if len(changes) != len(change_keys):
+            return False
+        jadwal_makul_ids = set(changes.values())
+        for jadwal_makul_id in jadwal_makul_ids:
+            self.remove(jadwal_makul_id)
+        for booking in models.JadwalMakul.objects\
+                .filter(id__in=jadwal_makul_ids)\
+                .values('id', 'ruangan_id', 'hari', 'jam_mulai', 'jam_selesai'):
+            self.add(booking)
+        self.change = change
+        return True
+
+    def get_bitmaps(self):
+        state = cache.get_many([self.VERSION_KEY, self.CHANGE_KEY])
+        version = state.get(self.VERSION_KEY)
+        if version is None:
+            version = cache.get_or_set(self.VERSION_KEY, 1, None)
+        change = state.get(self.CHANGE_KEY, 0)
+        if version != self.version or not self.apply_changes(change):
+            self.load(version, change)
+        return self.bitmaps
+
+    def publish(self, jadwal_makul_id):
+        ''' Announces a saved or deleted 'JadwalMakul' to every worker, called after the commit. '''
+        cache.add(self.CHANGE_KEY, 0, None)
+        change = cache.incr(self.CHANGE_KEY)
+        cache.set(f'{self.CHANGE_KEY}:{change}', jadwal_makul_id, self.TIMEOUT)
+
+    def invalidate(self):
+        try:
+            cache.incr(self.VERSION_KEY)
+        except ValueError:
+            cache.set(self.VERSION_KEY, 1, None)
+
+    def is_free(self, ruangan_id, hari, jam_mulai, jam_selesai):
+        return not self.get_bitmaps().get((ruangan_id, hari), 0) & get_mask(jam_mulai, jam_selesai)
+
+    def get_free_rooms(self, ruangan_ids, hari, jam_mulai, jam_selesai):
+        ''' Returns the 'ruangan_ids' that have no 'JadwalMakul' overlapping [jam_mulai, jam_selesai) on 'hari'. '''
+        mask = get_mask(jam_mulai, jam_selesai)
+        bitmaps = self.get_bitmaps()
+        return [ruangan_id for ruangan_id in ruangan_ids if not bitmaps.get((ruangan_id, hari), 0) & mask]
+
+
+occupancy_cache = OccupancyCache()
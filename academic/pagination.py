@@ -0,0 +1,31 @@
+from django.conf import settings
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+
+
+class StandardPageNumberPagination(PageNumberPagination):
+    page_size_query_param = 'page_size'
+    max_page_size = settings.API_MAX_PAGE_SIZE
+
+    def paginate_queryset(self, queryset, request, view=None):
+        # Pages of an unordered queryset can overlap or skip rows
+        if not queryset.ordered:
+            queryset = queryset.order_by('pk')
+        return super().paginate_queryset(queryset, request, view)
+
+
+class StandardCursorPagination(CursorPagination):
+    '''
+    Keyset pagination for large tables that mostly grow, every page is one indexed range query
+    however deep the client scrolls, and rows added meanwhile don't shift the pages.
+    '''
+    ordering = '-id'
+    page_size_query_param = 'page_size'
+    max_page_size = settings.API_MAX_PAGE_SIZE
+
+    def get_ordering(self, request, queryset, view):
+        # The cursor holds the value of the first field, rows sharing it (e.g. '?ordering=ips') keep
+        # their order between pages only with a unique field last
+        ordering = list(super().get_ordering(request, queryset, view))
+        if not any(field.lstrip('-') in ['id', 'pk'] for field in ordering):
+            ordering.append('-id' if ordering[0].startswith('-') else 'id')
+        return tuple(ordering)
@@ -0,0 +1,173 @@
+from django.core.files.storage import default_storage
+from django.http import Http404
+from rest_framework.response import Response
+
+from . import models
+
+HARI_LIST = dict(models.JadwalMakul.HARI_CHOICES)
+
+
+def format_iso(value):
+    return value.isoformat() if value is not None else None
+
+
+def format_file(name, request):
+    ''' Same as a DRF 'FileField': the absolute url of the file when there is a request. '''
+    if not name:
+        return None
+    url = default_storage.url(name)
+    return request.build_absolute_uri(url) if request is not None else url
+
+
+class MahasiswaReader:
+    '''
+    Builds the payload of 'MahasiswaSerializer' from one joined '.values()' query, without model
+    instances or serializer fields per row.
+    '''
+    VALUES = [
+        'nim', 'user__first_name', 'user__last_name', 'user__username', 'user__email',
+        'tahun_angkatan', 'tanggal_lahir', 'alamat', 'no_hp', 'foto_profil',
+        'pembimbing_akademik_id', 'pembimbing_akademik__nip', 'pembimbing_akademik__nama', 'pembimbing_akademik__gelar',
+        'kelas_id', 'kelas__huruf', 'kelas__semester_id',
+        'kelas__prodi__kode', 'kelas__prodi__nama', 'kelas__prodi__no_sk', 'kelas__prodi__tanggal_sk',
+        'kelas__prodi__tahun_operasional', 'kelas__prodi__akreditasi',
+        'kelas__prodi__jurusan_id', 'kelas__prodi__jurusan__nama',
+        'kelas__prodi__program_pendidikan_id', 'kelas__prodi__program_pendidikan__nama',
+    ]
+
+    def __init__(self, request=None):
+        self.request = request
+
+    def get_queryset(self, queryset):
+        return queryset.prefetch_related(None).values(*self.VALUES)
+
+    def to_representation(self, rows):
+        return [self.to_dict(row) for row in rows]
+
+    def to_dict(self, row):
+        return {
+            'nim': row['nim'],
+            'nama_depan': row['user__first_name'],
+            'nama_belakang': row['user__last_name'],
+            'username': row['user__username'],
+            'email': row['user__email'],
+            'tahun_angkatan': row['tahun_angkatan'],
+            'tanggal_lahir': format_iso(row['tanggal_lahir']),
+            'alamat': row['alamat'],
+            'no_hp': row['no_hp'],
+            'foto_profil': format_file(row['foto_profil'], self.request),
+            'pembimbing_akademik': {
+                'nip': row['pembimbing_akademik__nip'],
+                'nama': row['pembimbing_akademik__nama'],
+                'gelar': row['pembimbing_akademik__gelar'],
+            } if row['pembimbing_akademik_id'] is not None else None,
+            'kelas': {
+                'id': row['kelas_id'],
+                'huruf': row['kelas__huruf'],
+                'prodi': {
+                    'kode': row['kelas__prodi__kode'],
+                    'nama': row['kelas__prodi__nama'],
+                    'no_sk': row['kelas__prodi__no_sk'],
+                    'tanggal_sk': format_iso(row['kelas__prodi__tanggal_sk']),
+                    'tahun_operasional': row['kelas__prodi__tahun_operasional'],
+                    'jurusan': {
+                        'id': row['kelas__prodi__jurusan_id'],
+                        'nama': row['kelas__prodi__jurusan__nama'],
+                    },
+                    'program_pendidikan': {
+                        'kode': row['kelas__prodi__program_pendidikan_id'],
+                        'nama': row['kelas__prodi__program_pendidikan__nama'],
+                    },
+                    'akreditasi': row['kelas__prodi__akreditasi'],
+                },
+                'semester': row['kelas__semester_id'],
+            },
+        }
+
+
+class DosenReader:
+    '''
+    Builds the payload of 'DosenSerializer' with one '.values()' query for the 'dosen' of the page and
+    one for all of their 'makul_ajar'.
+    '''
+    VALUES = ['id', 'nip', 'nama', 'email', 'no_hp', 'gelar', 'prodi_id', 'prodi__kode', 'prodi__nama', 'foto_profil']
+    MAKUL_AJAR_VALUES = [
+        'id', 'dosen_id', 'jam_mulai', 'jam_selesai', 'hari', 'ruangan__nama', 'ruangan__gedung__nama',
+        'mata_kuliah__kode', 'mata_kuliah__nama', 'mata_kuliah__jumlah_sks_teori', 'mata_kuliah__jumlah_sks_praktik',
+        'jadwal_id', 'jadwal__kelas__semester_id',
+    ]
+
+    def __init__(self, request=None):
+        self.request = request
+
+    def get_queryset(self, queryset):
+        return queryset.prefetch_related(None).values(*self.VALUES)
+
+    def to_representation(self, rows):
+        rows = list(rows)
+        makul_ajar = {}
+        for jadwal_makul in models.JadwalMakul.objects\
+                .filter(dosen_id__in=[row['id'] for row in rows])\
+                .order_by('id')\
+                .values(*self.MAKUL_AJAR_VALUES):
+            makul_ajar.setdefault(jadwal_makul['dosen_id'], []).append({
+                'id': jadwal_makul['id'],
+                'jam_mulai': format_iso(jadwal_makul['jam_mulai']),
+                'jam_selesai': format_iso(jadwal_makul['jam_selesai']),
+                'nama_hari': HARI_LIST.get(jadwal_makul['hari'], jadwal_makul['hari']),
+                'ruangan': {'nama': jadwal_makul['ruangan__nama'], 'gedung': jadwal_makul['ruangan__gedung__nama']},
+                'mata_kuliah': {
+                    'kode': jadwal_makul['mata_kuliah__kode'],
+                    'nama': jadwal_makul['mata_kuliah__nama'],
+                    'sks': jadwal_makul['mata_kuliah__jumlah_sks_teori'] + jadwal_makul['mata_kuliah__jumlah_sks_praktik'],
+                },
+                'jadwal': {'id': jadwal_makul['jadwal_id'], 'semester': jadwal_makul['jadwal__kelas__semester_id']},
+            })
+        return [
+            {
+                'nip': row['nip'],
+                'nama': row['nama'],
+                'email': row['email'],
+                'no_hp': row['no_hp'],
+                'gelar': row['gelar'],
+                'prodi': {'id': row['prodi_id'], 'kode': row['prodi__kode'], 'nama': row['prodi__nama']},
+                'foto_profil': format_file(row['foto_profil'], self.request),
+                'makul_ajar': makul_ajar.get(row['id'], []),
+            } for row in rows
+        ]
+
+
+class FastReadMixin:
+    '''
+    Serves 'list' and 'retrieve' with 'fast_read_class', which builds the same payload as the
+    serializer straight from '.values()'. Requests using '?fields=' or '?expand=' keep the serializer.
+    '''
+    fast_read_class = None
+
+    def use_fast_read(self):
+        return self.fast_read_class is not None and \
+            not any(param in self.request.query_params for param in ['fields', 'expand'])
+
+    def list(self, request, *args, **kwargs):
+        if not self.use_fast_read():
+            return super().list(request, *args, **kwargs)
+        reader = self.fast_read_class(request)
+        queryset = reader.get_queryset(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(reader.to_representation(page))
+        return Response(reader.to_representation(queryset))
+
+    def retrieve(self, request, *args, **kwargs):
+        if not self.use_fast_read():
+            return super().retrieve(request, *args, **kwargs)
+        # The permissions of these viewsets are view-level only, there is no object to check
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        reader = self.fast_read_class(request)
+        queryset = reader.get_queryset(
+            self.filter_queryset(self.get_queryset()).filter(**{self.lookup_field: kwargs[lookup_url_kwarg]})
+        )
+        data = reader.to_representation(queryset[:1])
+        if not data:
+            raise Http404
+        return Response(data[0])
@@ -0,0 +1,275 @@
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils import timezone
+from import_export import fields, resources, widgets
+from import_export.instance_loaders import CachedInstanceLoader
+
+from . import models, scheduling
+from .jadwal_cache import invalidate_jadwal_kelas
+from .occupancy import occupancy_cache
+from .utilization import invalidate_utilisasi
+
+HARI_LIST = {
+    **{hari.lower(): hari for hari, nama in models.JadwalMakul.HARI_CHOICES},
+    **{nama.lower(): hari for hari, nama in models.JadwalMakul.HARI_CHOICES},
+}
+
+
+def clean_text(value):
+    ''' Spreadsheet cells holding codes often come back as floats, e.g. a NIP typed as a number. '''
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return '' if value is None else str(value).strip()
+
+
+def clean_number(value):
+    value = clean_text(value)
+    try:
+        return int(float(value))
+    except ValueError:
+        return None
+
+
+def set_column(dataset, header, values):
+    if header in dataset.headers:
+        del dataset[header]
+    dataset.append_col(values, header=header)
+
+
+class KelasLookup:
+    '''
+    Resolves the natural key of a 'kelas' ('prodi' kode, 'semester' no and 'huruf') to its id and its
+    'jadwal' id with dictionaries loaded once per import instead of a query per row.
+    '''
+    def __init__(self):
+        self.prodi_list = dict(models.ProgramStudi.objects.values_list('kode', 'id'))
+        self.kelas_list = {
+            (prodi_id, semester_id, huruf.upper()): kelas_id
+            for kelas_id, prodi_id, semester_id, huruf in models.Kelas.objects.values_list('id', 'prodi_id', 'semester_id', 'huruf')
+        }
+        self.jadwal_list = dict(models.Jadwal.objects.values_list('kelas_id', 'id'))
+
+    def get_kelas_id(self, row):
+        prodi_id = self.prodi_list.get(clean_text(row.get('prodi')))
+        if prodi_id is None:
+            raise ValidationError({'prodi': f'Unknown "prodi" {row.get("prodi")}'})
+        kelas_id = self.kelas_list.get((prodi_id, clean_number(row.get('semester')), clean_text(row.get('kelas')).upper()))
+        if kelas_id is None:
+            raise ValidationError({'kelas': f'Unknown "kelas" {row.get("prodi")} {row.get("semester")} {row.get("kelas")}'})
+        return kelas_id
+
+    def create_missing_jadwal(self, kelas_ids):
+        missing = {kelas_id for kelas_id in kelas_ids if kelas_id not in self.jadwal_list}
+        if missing:
+            models.Jadwal.objects.bulk_create([models.Jadwal(kelas_id=kelas_id) for kelas_id in missing])
+            self.jadwal_list.update(models.Jadwal.objects.filter(kelas_id__in=missing).values_list('kelas_id', 'id'))
+
+
+class JadwalResource(resources.ModelResource):
+    prodi = fields.Field(column_name='prodi')
+    semester = fields.Field(column_name='semester')
+    kelas = fields.Field(column_name='kelas')
+    kelas_id = fields.Field(attribute='kelas_id', column_name='kelas_id', widget=widgets.IntegerWidget())
+
+    def get_queryset(self):
+        return models.Jadwal.objects.select_related('kelas__prodi')
+
+    def get_export_fields(self):
+        return [field for field in self.get_fields() if field.column_name != 'kelas_id']
+
+    def before_import(self, dataset, using_transactions, dry_run, **kwargs):
+        lookup = KelasLookup()
+        self.row_errors = {}
+        kelas_ids = []
+        for row_number, row in enumerate(dataset.dict, 1):
+            try:
+                kelas_ids.append(lookup.get_kelas_id(row))
+            except ValidationError as error:
+                self.row_errors[row_number] = error
+                kelas_ids.append(None)
+        set_column(dataset, 'kelas_id', kelas_ids)
+
+    def before_import_row(self, row, row_number=None, **kwargs):
+        if row_number in self.row_errors:
+            raise self.row_errors[row_number]
+
+    def dehydrate_prodi(self, jadwal):
+        return jadwal.kelas.prodi.kode
+
+    def dehydrate_semester(self, jadwal):
+        return jadwal.kelas.semester_id
+
+    def dehydrate_kelas(self, jadwal):
+        return jadwal.kelas.huruf
+
+    class Meta:
+        model = models.Jadwal
+        fields = ['id']
+        import_id_fields = ['kelas_id']
+        export_order = ['id', 'prodi', 'semester', 'kelas']
+        skip_unchanged = True
+        use_bulk = True
+        use_transactions = True
+        instance_loader_class = CachedInstanceLoader
+
+
+class JadwalMakulResource(resources.ModelResource):
+    '''
+    A row names its 'kelas' ('prodi', 'semester', 'kelas'), 'mata_kuliah' kode, 'dosen' nip and
+    'ruangan' ('gedung', 'ruangan'). Every name is resolved in 'before_import' with dictionaries and
+    every row is checked against the timetable with an in-memory 'ScheduleIndex', so the import runs
+    a fixed number of queries and writes with bulk inserts in one transaction.
+    '''
+    prodi = fields.Field(column_name='prodi')
+    semester = fields.Field(column_name='semester')
+    kelas = fields.Field(column_name='kelas')
+    mata_kuliah = fields.Field(column_name='mata_kuliah')
+    dosen = fields.Field(column_name='dosen')
+    gedung = fields.Field(column_name='gedung')
+    ruangan = fields.Field(column_name='ruangan')
+    jadwal_id = fields.Field(attribute='jadwal_id', column_name='jadwal_id', widget=widgets.IntegerWidget())
+    mata_kuliah_id = fields.Field(attribute='mata_kuliah_id', column_name='mata_kuliah_id', widget=widgets.IntegerWidget())
+    dosen_id = fields.Field(attribute='dosen_id', column_name='dosen_id', widget=widgets.IntegerWidget())
+    ruangan_id = fields.Field(attribute='ruangan_id', column_name='ruangan_id', widget=widgets.IntegerWidget())
+
+    RESOLVED_COLUMNS = ['jadwal_id', 'mata_kuliah_id', 'dosen_id', 'ruangan_id']
+
+    def get_queryset(self):
+        return models.JadwalMakul.objects.select_related('jadwal__kelas__prodi', 'mata_kuliah', 'dosen', 'ruangan__gedung')
+
+    def get_export_fields(self):
+        return [field for field in self.get_fields() if field.column_name not in self.RESOLVED_COLUMNS]
+
+    def resolve_row(self, row, lookup, mata_kuliah_list, dosen_list, ruangan_list):
+        errors = {}
+        try:
+            kelas_id = lookup.get_kelas_id(row)
+        except ValidationError as error:
+            errors.update(error.message_dict)
+            kelas_id = None
+        mata_kuliah_id = mata_kuliah_list.get(clean_text(row.get('mata_kuliah')))
+        if mata_kuliah_id is None:
+            errors['mata_kuliah'] = f'Unknown "mata_kuliah" {row.get("mata_kuliah")}'
+        dosen_id = None
+        if clean_text(row.get('dosen')):
+            dosen_id = dosen_list.get(clean_text(row.get('dosen')))
+            if dosen_id is None:
+                errors['dosen'] = f'Unknown "dosen" {row.get("dosen")}'
+        ruangan_id = ruangan_list.get((clean_text(row.get('gedung')).lower(), clean_text(row.get('ruangan')).lower()))
+        if ruangan_id is None:
+            errors['ruangan'] = f'Unknown "ruangan" {row.get("gedung")} {row.get("ruangan")}'
+        hari = HARI_LIST.get(clean_text(row.get('hari')).lower())
+        if hari is None:
+            errors['hari'] = f'Unknown "hari" {row.get("hari")}'
+        try:
+            jam_mulai = widgets.TimeWidget().clean(row.get('jam_mulai'))
+            jam_selesai = widgets.TimeWidget().clean(row.get('jam_selesai'))
+            if not jam_mulai or not jam_selesai or jam_mulai >= jam_selesai:
+                errors['jam_selesai'] = '"jam_selesai" should be later than "jam_mulai"'
+        except ValueError as error:
+            errors['jam_mulai'] = str(error)
+        if errors:
+            raise ValidationError(errors)
+        return {
+            'id': clean_number(row.get('id')),
+            'kelas_id': kelas_id,
+            'mata_kuliah_id': mata_kuliah_id,
+            'dosen_id': dosen_id,
+            'ruangan_id': ruangan_id,
+            'hari': hari,
+            'jam_mulai': jam_mulai,
+            'jam_selesai': jam_selesai,
+        }
+
+    def before_import(self, dataset, using_transactions, dry_run, **kwargs):
+        lookup = KelasLookup()
+        mata_kuliah_list = dict(models.MataKuliah.objects.values_list('kode', 'id'))
+        dosen_list = dict(models.Dosen.objects.values_list('nip', 'id'))
+        ruangan_list = {
+            (gedung.lower(), nama.lower()): ruangan_id
+            for ruangan_id, gedung, nama in models.Ruangan.objects.values_list('id', 'gedung__nama', 'nama')
+        }
+
+        self.row_errors = {}
+        bookings = []
+        for row_number, row in enumerate(dataset.dict, 1):
+            try:
+                bookings.append(self.resolve_row(row, lookup, mata_kuliah_list, dosen_list, ruangan_list))
+            except ValidationError as error:
+                self.row_errors[row_number] = error
+                bookings.append(None)
+
+        # A 'jadwal' is needed before its rows can be inserted, the missing ones are created at once
+        lookup.create_missing_jadwal({booking['kelas_id'] for booking in bookings if booking})
+        for booking in bookings:
+            if booking:
+                booking['jadwal_id'] = lookup.jadwal_list[booking['kelas_id']]
+
+        index = scheduling.ScheduleIndex(scheduling.load_bookings())
+        for row_number, booking in enumerate(bookings, 1):
+            if not booking:
+                continue
+            # An updated row replaces its old booking, which stays booked when the row fails
+            old_booking = index.remove(booking['id']) if booking['id'] is not None else None
+            conflicts = index.conflicts(booking)
+            if conflicts:
+                self.row_errors[row_number] = ValidationError([scheduling.describe_conflict(conflict) for conflict in conflicts])
+                if old_booking is not None:
+                    index.add(old_booking)
+                continue
+            index.add(booking)
+
+        if 'id' not in dataset.headers:
+            set_column(dataset, 'id', [None] * len(dataset))
+        for column in self.RESOLVED_COLUMNS:
+            set_column(dataset, column, [booking[column] if booking else None for booking in bookings])
+        set_column(dataset, 'hari', [booking['hari'] if booking else row.get('hari') for booking, row in zip(bookings, dataset.dict)])
+        self.kelas_ids = {booking['kelas_id'] for booking in bookings if booking}
+
+    def before_import_row(self, row, row_number=None, **kwargs):
+        if row_number in self.row_errors:
+            raise self.row_errors[row_number]
+
+    def before_save_instance(self, instance, using_transactions, dry_run):
+        # bulk_update leaves 'auto_now' fields alone
+        instance.tanggal_diperbarui = timezone.now()
+
+    def after_import(self, dataset, result, using_transactions, dry_run, **kwargs):
+        # The bulk writes skip the signals that keep these caches up to date
+        if not dry_run:
+            kelas_ids = self.kelas_ids
+            transaction.on_commit(occupancy_cache.invalidate)
+            transaction.on_commit(lambda: invalidate_jadwal_kelas(kelas_ids))
+            transaction.on_commit(invalidate_utilisasi)
+
+    def dehydrate_prodi(self, jadwal_makul):
+        return jadwal_makul.jadwal.kelas.prodi.kode
+
+    def dehydrate_semester(self, jadwal_makul):
+        return jadwal_makul.jadwal.kelas.semester_id
+
+    def dehydrate_kelas(self, jadwal_makul):
+        return jadwal_makul.jadwal.kelas.huruf
+
+    def dehydrate_mata_kuliah(self, jadwal_makul):
+        return jadwal_makul.mata_kuliah.kode
+
+    def dehydrate_dosen(self, jadwal_makul):
+        return jadwal_makul.dosen.nip if jadwal_makul.dosen else ''
+
+    def dehydrate_gedung(self, jadwal_makul):
+        return jadwal_makul.ruangan.gedung.nama
+
+    def dehydrate_ruangan(self, jadwal_makul):
+        return jadwal_makul.ruangan.nama
+
+    class Meta:
+        model = models.JadwalMakul
+        fields = ['id', 'hari', 'jam_mulai', 'jam_selesai']
+        export_order = ['id', 'prodi', 'semester', 'kelas', 'mata_kuliah', 'dosen',
+                        'gedung', 'ruangan', 'hari', 'jam_mulai', 'jam_selesai']
+        skip_diff = True
+        use_bulk = True
+        batch_size = 1000
+        use_transactions = True
+        instance_loader_class = CachedInstanceLoader
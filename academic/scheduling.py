@@ -0,0 +1,236 @@
+from datetime import datetime
+import random
+
+from django.db.models import Q
+
+from . import models
+
+BOOKING_FIELDS = ['id', 'hari', 'jam_mulai', 'jam_selesai', 'ruangan_id', 'dosen_id', 'jadwal_id']
+
+# A 'JadwalMakul' books its 'ruangan', its 'dosen' and its 'jadwal' (the 'kelas') at the same time,
+# none of them can be booked twice at overlapping hours on the same day.
+RESOURCES = ['ruangan', 'dosen', 'jadwal']
+
+# The hours rooms can be booked on a day
+DAY_START = datetime.strptime('07:30', '%H:%M').time()
+DAY_END = datetime.strptime('17:30', '%H:%M').time()
+
+
+def booking_from_instance(jadwal_makul):
+    return {field: getattr(jadwal_makul, field) for field in BOOKING_FIELDS}
+
+
+def load_bookings(queryset=None):
+    if queryset is None:
+        queryset = models.JadwalMakul.objects.all()
+    return list(queryset.values(*BOOKING_FIELDS))
+
+
+def get_keys(booking):
+    return [
+        (resource, booking[f'{resource}_id'], booking['hari'])
+        for resource in RESOURCES if booking[f'{resource}_id'] is not None
+    ]
+
+
+class IntervalNode:
+    __slots__ = ['interval', 'priority', 'left', 'right', 'max_end']
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.priority = random.random()
+        self.left = None
+        self.right = None
+        self.max_end = interval[1]
+
+    def update(self):
+        self.max_end = self.interval[1]
+        for child in [self.left, self.right]:
+            if child is not None and child.max_end > self.max_end:
+                self.max_end = child.max_end
+
+
+class IntervalTree:
+    '''
+    A treap of (jam_mulai, jam_selesai, sequence) tuples in tuple order, where every node also keeps
+    the latest 'jam_selesai' of its subtree. Adding and removing take O(log n) on average. Finding
+    the intervals that overlap [start, end) takes O(log n + k): subtrees that all end by 'start' are
+    skipped, and so are the intervals that start at or after 'end'.
+    '''
+    def __init__(self):
+        self.root = None
+
+    def add(self, interval):
+        self.root = self.insert(self.root, IntervalNode(interval))
+
+    def remove(self, interval):
+        self.root = self.delete(self.root, interval)
+
+    def overlapping(self, start, end):
+        result = []
+        self.collect(self.root, start, end, result)
+        return result
+
+    def insert(self, node, new):
+        if node is None:
+            return new
+        if new.priority > node.priority:
+            new.left, new.right = self.split(node, new.interval)
+            new.update()
+            return new
+        if new.interval < node.interval:
+            node.left = self.insert(node.left, new)
+        else:
+            node.right = self.insert(node.right, new)
+        node.update()
+        return node
+
+    def delete(self, node, interval):
+        if node is None:
+            return None
+        if interval == node.interval:
+            return self.merge(node.left, node.right)
+        if interval < node.interval:
+            node.left = self.delete(node.left, interval)
+        else:
+            node.right = self.delete(node.right, interval)
+        node.update()
+        return node
+
+    def split(self, node, interval):
+        ''' Splits the subtree into the intervals before 'interval' and the ones from it on. '''
+        if node is None:
+            return None, None
+        if node.interval < interval:
+            node.right, right = self.split(node.right, interval)
+            node.update()
+            return node, right
+        left, node.left = self.split(node.left, interval)
+        node.update()
+        return left, node
+
+    def merge(self, left, right):
+        if left is None or right is None:
+            return left or right
+        if left.priority > right.priority:
+            left.right = self.merge(left.right, right)
+            left.update()
+            return left
+        right.left = self.merge(left, right.left)
+        right.update()
+        return right
+
+    def collect(self, node, start, end, result):
+        if node is None or node.max_end <= start:
+            return
+        self.collect(node.left, start, end, result)
+        jam_mulai, jam_selesai, sequence = node.interval
+        if jam_mulai >= end:
+            return
+        if jam_selesai > start:
+            result.append(node.interval)
+        self.collect(node.right, start, end, result)
+
+
+class ScheduleIndex:
+    '''
+    Keeps the booked intervals of every 'ruangan', 'dosen' and 'jadwal' in an 'IntervalTree', one
+    per resource and day, so checking a new booking only visits the intervals overlapping it and
+    the paths to them. The intervals already in the index can overlap each other, e.g. legacy data.
+    '''
+    def __init__(self, bookings=()):
+        self.intervals = {}
+        self.bookings = {}
+        self.sequences = {}
+        self.sequence = 0
+        for booking in bookings:
+            self.add(booking)
+
+    @classmethod
+    def from_queryset(cls, queryset):
+        return cls(load_bookings(queryset))
+
+    def add(self, booking):
+        # The sequence number keeps the tuples comparable for bookings that aren't saved yet
+        self.sequence += 1
+        self.bookings[self.sequence] = booking
+        if booking['id'] is not None:
+            self.sequences[booking['id']] = self.sequence
+        for key in get_keys(booking):
+            self.intervals.setdefault(key, IntervalTree()).add((booking['jam_mulai'], booking['jam_selesai'], self.sequence))
+
+    def remove(self, booking_id):
+        ''' Removes the booking with the id and returns it, or None when it isn't in the index. '''
+        sequence = self.sequences.pop(booking_id, None)
+        if sequence is None:
+            return None
+        booking = self.bookings.pop(sequence)
+        for key in get_keys(booking):
+            self.intervals[key].remove((booking['jam_mulai'], booking['jam_selesai'], sequence))
+        return booking
+
+    def conflicts(self, booking):
+        ''' Returns the conflicts between 'booking' and the bookings already in the index. '''
+        result = []
+        for key in get_keys(booking):
+            if key not in self.intervals:
+                continue
+            for jam_mulai, jam_selesai, sequence in self.intervals[key].overlapping(booking['jam_mulai'], booking['jam_selesai']):
+                other = self.bookings[sequence]
+                if other['id'] is None or other['id'] != booking['id']:
+                    result.append(make_conflict(key, booking, other))
+        return result
+
+
+def make_conflict(key, booking, other):
+    resource, resource_id, hari = key
+    return {
+        'resource': resource,
+        f'{resource}_id': resource_id,
+        'hari': hari,
+        'jadwal_makul': [booking['id'], other['id']],
+    }
+
+
+def audit(bookings):
+    '''
+    Finds every conflict in a whole timetable with one sweep over the bookings of each
+    resource and day, sorted by 'jam_mulai'.
+    '''
+    groups = {}
+    for booking in bookings:
+        for key in get_keys(booking):
+            groups.setdefault(key, []).append(booking)
+
+    result = []
+    for key, group in groups.items():
+        group.sort(key=lambda booking: (booking['jam_mulai'], booking['jam_selesai']))
+        active = []
+        for booking in group:
+            active = [other for other in active if other['jam_selesai'] > booking['jam_mulai']]
+            for other in active:
+                result.append(make_conflict(key, booking, other))
+            active.append(booking)
+    return result
+
+
+def check_booking(booking, exclude_ids=()):
+    '''
+    Checks a single booking against the database. Only the bookings of the same day that share
+    its 'ruangan', 'dosen' or 'jadwal' are loaded.
+    '''
+    resources = Q()
+    for resource in RESOURCES:
+        if booking[f'{resource}_id'] is not None:
+            resources |= Q(**{f'{resource}_id': booking[f'{resource}_id']})
+    queryset = models.JadwalMakul.objects\
+        .filter(resources, hari=booking['hari'])\
+        .exclude(id__in=[booking_id for booking_id in exclude_ids if booking_id])
+    return ScheduleIndex.from_queryset(queryset).conflicts(booking)
+
+
+def describe_conflict(conflict):
+    hari = dict(models.JadwalMakul.HARI_CHOICES)[conflict['hari']]
+    jadwal_makul = ', '.join(str(booking_id) for booking_id in conflict['jadwal_makul'] if booking_id)
+    return f'The "{conflict["resource"]}" {conflict[conflict["resource"] + "_id"]} is already booked on {hari}' + \
+           (f' by "jadwal_makul" {jadwal_makul}' if jadwal_makul else '')
@@ -0,0 +1,65 @@
+from django.db import connection
+from django.db.models import Case, CharField, F, IntegerField, Q, Value, When
+from django.db.models.functions import Concat
+
+from . import models
+
+SEARCH_LIMIT = 20
+
+# Terms past this many don't narrow the results much more and each one adds conditions to the query
+MAX_TERMS = 5
+
+
+def get_terms(q):
+    return q.split()[:MAX_TERMS]
+
+
+def search_mahasiswa(q, queryset=None):
+    '''
+    Finds 'mahasiswa' whose nim starts with the query or whose name looks like it, every word of the
+    query has to match. A nim match comes first, then the closest names. The caller slices the
+    results, e.g. to 'SEARCH_LIMIT'.
+    '''
+    if queryset is None:
+        queryset = models.Mahasiswa.objects.all()
+    terms = get_terms(q)
+    if not terms:
+        return queryset.none()
+    queryset = queryset.annotate(nim_match=Case(
+        When(nim__startswith=q.strip(), then=Value(1)), default=Value(0), output_field=IntegerField()
+    ))
+    if connection.vendor == 'postgresql':
+        queryset = search_postgresql(queryset, q, terms)
+    else:
+        queryset = search_fallback(queryset, terms)
+    return queryset
+
+
+def search_postgresql(queryset, q, terms):
+    '''
+    Name matches use the word similarity operator of 'pg_trgm', which the trigram GIN indexes on
+    the user table serve, and nim prefixes the 'varchar_pattern_ops' index of the unique nim.
+    '''
+    # Imported here since 'django.contrib.postgres' needs psycopg, which the other databases don't
+    from django.contrib.postgres.lookups import TrigramWordSimilar
+    from django.contrib.postgres.search import TrigramWordSimilarity
+
+    for term in terms:
+        queryset = queryset.filter(
+            Q(nim__startswith=term) |
+            Q(TrigramWordSimilar(F('user__first_name'), term)) |
+            Q(TrigramWordSimilar(F('user__last_name'), term))
+        )
+    nama = Concat('user__first_name', Value(' '), 'user__last_name', output_field=CharField())
+    return queryset\
+        .annotate(similarity=TrigramWordSimilarity(q, nama))\
+        .order_by('-nim_match', '-similarity', 'nim')
+
+
+def search_fallback(queryset, terms):
+    ''' Plain substring matches for the databases without 'pg_trgm', e.g. SQLite in the tests. '''
+    for term in terms:
+        queryset = queryset.filter(
+            Q(nim__startswith=term) | Q(user__first_name__icontains=term) | Q(user__last_name__icontains=term)
+        )
+    return queryset.order_by('-nim_match', 'user__first_name', 'user__last_name', 'nim')
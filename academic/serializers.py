@@ -1,6 +1,58 @@
+from django.db import IntegrityError, transaction
 from rest_framework import serializers
 
 from . import models
+from .grading import get_grading_scale, get_grading_scales
+from .scheduling import check_booking, describe_conflict
+from .utils import generate_khs, invalidate_khs_pdf_cache, refresh_khs_totals
+
+
+class DynamicFieldsMixin:
+    '''
+    Lets the client pick the fields with '?fields=nim,kelas' and the nested serializers to render with
+    '?expand=kelas'. Without 'expand' every nested serializer is rendered like before, with it the
+    others are collapsed to their primary keys. Only the top-level serializer reads the parameters.
+    '''
+    @staticmethod
+    def get_param(request, name):
+        # A plain Django request in the context has 'GET' but not the 'query_params' of DRF
+        params = getattr(request, 'query_params', getattr(request, 'GET', None))
+        if params is None or name not in params:
+            return None
+        return {value.strip() for value in params[name].split(',') if value.strip()}
+
+    @classmethod
+    def is_requested(cls, request, field_name):
+        fields = cls.get_param(request, 'fields')
+        return fields is None or field_name in fields
+
+    @classmethod
+    def is_expanded(cls, request, field_name):
+        ''' Whether 'field_name' is rendered by its nested serializer, views use it to pick their joins. '''
+        expand = cls.get_param(request, 'expand')
+        return cls.is_requested(request, field_name) and (expand is None or field_name in expand)
+
+    def is_root(self):
+        root = self.parent if isinstance(self.parent, serializers.ListSerializer) else self
+        return root.parent is None
+
+    def get_fields(self):
+        fields = super().get_fields()
+        request = self.context.get('request')
+        if request is None or not self.is_root():
+            return fields
+        requested = self.get_param(request, 'fields')
+        if requested is not None:
+            fields = {name: field for name, field in fields.items() if name in requested}
+        expand = self.get_param(request, 'expand')
+        if expand is not None:
+            for name, field in fields.items():
+                if isinstance(field, serializers.BaseSerializer) and name not in expand:
+                    kwargs = {'source': field.source} if field.source else {}
+                    fields[name] = serializers.PrimaryKeyRelatedField(
+                        read_only=True, many=isinstance(field, serializers.ListSerializer), **kwargs
+                    )
+        return fields
 
 
 class JurusanSerializer(serializers.ModelSerializer):
@@ -115,7 +167,7 @@ class DosenJadwalMakulSerializer(serializers.ModelSerializer):
         fields = ['id', 'jam_mulai', 'jam_selesai', 'nama_hari', 'ruangan', 'mata_kuliah', 'jadwal']
 
 
-class DosenSerializer(serializers.ModelSerializer):
+class DosenSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     prodi = SimpleProgramStudiSerializer()
     makul_ajar = DosenJadwalMakulSerializer(many=True)
     
@@ -149,7 +201,7 @@ class CreateUpdateKelasSerializer(serializers.ModelSerializer):
         fields = ['id', 'prodi', 'semester', 'huruf']
 
 
-class MahasiswaSerializer(serializers.ModelSerializer):
+class MahasiswaSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     kelas = KelasSerializer()
     pembimbing_akademik = SimpleDosenSerializer()
 
@@ -165,7 +217,7 @@ class SimpleMahasiswaSerializer(serializers.ModelSerializer):
     nama = serializers.SerializerMethodField(method_name='get_nama')
 
     def get_nama(self, mahasiswa: models.Mahasiswa):
-        return f"{mahasiswa.user.first_name} {mahasiswa.user.last_name}"
+        return mahasiswa.nama_lengkap()
     
     class Meta:
         model = models.Mahasiswa
@@ -304,6 +356,26 @@ class SimpleJadwalMakulSerializer(serializers.ModelSerializer):
 
 
 class CreateUpdateJadwalMakulSerializer(serializers.ModelSerializer):
+    def validate(self, attrs):
+        def get_value(field):
+            return attrs[field] if field in attrs else getattr(self.instance, field, None)
+
+        booking = {
+            'id': getattr(self.instance, 'id', None),
+            'hari': get_value('hari') or models.JadwalMakul.HARI_SENIN,
+            'jam_mulai': get_value('jam_mulai'),
+            'jam_selesai': get_value('jam_selesai'),
+            'ruangan_id': getattr(get_value('ruangan'), 'id', None),
+            'dosen_id': getattr(get_value('dosen'), 'id', None),
+            'jadwal_id': self.instance.jadwal_id if self.instance else int(self.context['jadwal_id'])
+        }
+        if booking['jam_mulai'] >= booking['jam_selesai']:
+            raise serializers.ValidationError({'jam_selesai': ['"jam_selesai" should be later than "jam_mulai"']})
+        conflicts = check_booking(booking, exclude_ids=[booking['id']])
+        if conflicts:
+            raise serializers.ValidationError([describe_conflict(conflict) for conflict in conflicts])
+        return attrs
+
     def create(self, validated_data):
         return models.JadwalMakul.objects.create(
             jadwal_id=self.context['jadwal_id'],
@@ -312,7 +384,7 @@ class CreateUpdateJadwalMakulSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = models.JadwalMakul
-        fields = ['id', 'hari', 'jam_mulai'
+        fields = ['id', 'hari', 'jam_mulai',
                   'jam_selesai', 'dosen', 'ruangan', 
                   'mata_kuliah']
         
@@ -333,6 +405,27 @@ class SimpleRuanganSerializer(serializers.ModelSerializer):
         fields = ['id', 'nama', 'gedung']
 
 
+class SummaryRuanganSerializer(serializers.ModelSerializer):
+    gedung = GedungKuliahSerializer()
+    jumlah_jadwal = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = models.Ruangan
+        fields = ['id', 'nama', 'gedung', 'jumlah_jadwal']
+
+
+class RuanganTersediaSerializer(serializers.Serializer):
+    hari = serializers.ChoiceField(choices=models.JadwalMakul.HARI_CHOICES)
+    jam_mulai = serializers.TimeField()
+    jam_selesai = serializers.TimeField()
+    gedung_id = serializers.IntegerField(required=False)
+
+    def validate(self, attrs):
+        if attrs['jam_mulai'] >= attrs['jam_selesai']:
+            raise serializers.ValidationError({'jam_selesai': ['"jam_selesai" should be later than "jam_mulai"']})
+        return attrs
+
+
 class JadwalMakulSerializer(serializers.ModelSerializer):
     kode_hari = serializers.CharField(source='hari')
     hari = serializers.CharField(source='get_hari_display',  read_only=True)
@@ -371,33 +464,10 @@ class NilaiKHSSerializer(serializers.ModelSerializer):
 
 
 class CreateUpdateNilaiKHSSerializer(serializers.ModelSerializer):
-    def get_huruf_mutu(self, nilai):
-        if nilai in range(0, 50):
-            return 'E'
-        elif nilai in range(50, 60):
-            return 'D'
-        elif nilai in range(60, 70):
-            return 'C'
-        elif nilai in range(70, 80):
-            return 'B'
-        return 'A'
-
-    def get_angka_mutu(self, huruf_mutu):
-        if huruf_mutu == 'E':
-            return 0
-        elif huruf_mutu == 'D':
-            return 1
-        elif huruf_mutu == 'C':
-            return 2
-        elif huruf_mutu == 'B':
-            return 3
-        return 4
-    
     def create(self, validated_data):
         khs_id = self.context['khs_id']
-        nilai = validated_data['nilai']
-        huruf_mutu = self.get_huruf_mutu(nilai)
-        angka_mutu = self.get_angka_mutu(huruf_mutu)
+        scale = get_grading_scale(validated_data['mata_kuliah'].kurikulum_id)
+        huruf_mutu, angka_mutu = scale.convert(validated_data['nilai'])
         return models.NilaiKHS.objects.create(
             khs_id=khs_id,
             huruf_mutu=huruf_mutu,
@@ -406,9 +476,8 @@ class CreateUpdateNilaiKHSSerializer(serializers.ModelSerializer):
         )
     
     def update(self, instance, validated_data):
-        nilai = validated_data['nilai']
-        validated_data['huruf_mutu'] = self.get_huruf_mutu(nilai)
-        validated_data['angka_mutu'] = self.get_angka_mutu(validated_data['huruf_mutu'])
+        scale = get_grading_scale(validated_data['mata_kuliah'].kurikulum_id)
+        validated_data['huruf_mutu'], validated_data['angka_mutu'] = scale.convert(validated_data['nilai'])
         return super().update(instance, validated_data)
     
     class Meta:
@@ -416,23 +485,138 @@ class CreateUpdateNilaiKHSSerializer(serializers.ModelSerializer):
         fields = ['id', 'mata_kuliah', 'nilai']
 
 
+class BulkNilaiKHSItemSerializer(serializers.Serializer):
+    nim = serializers.CharField(max_length=10)
+    mata_kuliah = serializers.CharField(max_length=255)
+    nilai = serializers.DecimalField(max_digits=6, decimal_places=2, min_value=1, max_value=100)
+
+
+class BulkNilaiKHSSerializer(serializers.Serializer):
+    '''
+    Saves the scores of many students at once. Every row is a (nim, mata_kuliah kode, nilai),
+    the students and courses are resolved with set-based lookups and all rows are written with
+    'bulk_create'/'bulk_update' in one transaction. Rows that can't be saved are reported back
+    with their index instead of failing the whole request.
+    '''
+    tahun_akademik_awal = serializers.IntegerField(min_value=2000, max_value=3000)
+    tahun_akademik_akhir = serializers.IntegerField(min_value=2000, max_value=3000)
+    semester = serializers.IntegerField(min_value=1, required=False)
+    # Rows are validated one by one in 'save', so a malformed row doesn't reject the whole list
+    nilai_list = serializers.ListField(allow_empty=False)
+
+    def save(self, **kwargs):
+        errors = []
+        rows = []
+        for index, data in enumerate(self.validated_data['nilai_list']):
+            row = BulkNilaiKHSItemSerializer(data=data)
+            if row.is_valid():
+                rows.append((index, row.validated_data))
+            else:
+                errors.append({'index': index, 'errors': row.errors})
+
+        khs_filter = {
+            'tahun_akademik_awal': self.validated_data['tahun_akademik_awal'],
+            'tahun_akademik_akhir': self.validated_data['tahun_akademik_akhir']
+        }
+        if 'semester' in self.validated_data:
+            khs_filter['semester'] = self.validated_data['semester']
+
+        khs_list = {}
+        for khs_id, nim in models.KHS.objects\
+                .filter(mahasiswa__nim__in={row['nim'] for index, row in rows}, **khs_filter)\
+                .values_list('id', 'mahasiswa__nim'):
+            khs_list.setdefault(nim, []).append(khs_id)
+        mata_kuliah_list = {
+            kode: (mata_kuliah_id, kurikulum_id) for kode, mata_kuliah_id, kurikulum_id in models.MataKuliah.objects\
+                .filter(kode__in={row['mata_kuliah'] for index, row in rows})\
+                .values_list('kode', 'id', 'kurikulum_id')
+        }
+        nilai_khs_list = {
+            (nilai_khs.khs_id, nilai_khs.mata_kuliah_id): nilai_khs for nilai_khs in models.NilaiKHS.objects\
+                .filter(
+                    khs_id__in=[khs_id for khs_ids in khs_list.values() for khs_id in khs_ids],
+                    mata_kuliah_id__in=[mata_kuliah_id for mata_kuliah_id, kurikulum_id in mata_kuliah_list.values()]
+                )
+        }
+
+        created = {}
+        updated = {}
+        indexes = {}
+        kurikulum_list = {}
+        for index, row in rows:
+            khs_ids = khs_list.get(row['nim'], [])
+            if len(khs_ids) != 1:
+                message = 'No "khs" found for this "nim"' if not khs_ids else \
+                    'More than one "khs" found for this "nim", specify the "semester"'
+                errors.append({'index': index, 'errors': {'nim': [message]}})
+                continue
+            mata_kuliah_id, kurikulum_id = mata_kuliah_list.get(row['mata_kuliah'], (None, None))
+            if not mata_kuliah_id:
+                errors.append({'index': index, 'errors': {'mata_kuliah': ['No "mata_kuliah" found for this "kode"']}})
+                continue
+            key = (khs_ids[0], mata_kuliah_id)
+            if key in created or key in updated:
+                errors.append({'index': index, 'errors': {'mata_kuliah': ['This "mata_kuliah" is duplicated for this "nim"']}})
+                continue
+
+            nilai_khs = nilai_khs_list.get(key) or models.NilaiKHS(khs_id=key[0], mata_kuliah_id=key[1])
+            nilai_khs.nilai = row['nilai']
+            indexes[key] = index
+            kurikulum_list.setdefault(kurikulum_id, []).append(nilai_khs)
+            if nilai_khs.pk:
+                updated[key] = nilai_khs
+            else:
+                created[key] = nilai_khs
+
+        for kurikulum_id, scale in get_grading_scales(kurikulum_list.keys()).items():
+            kurikulum_nilai_khs_list = kurikulum_list[kurikulum_id]
+            grades = scale.convert_many([nilai_khs.nilai for nilai_khs in kurikulum_nilai_khs_list])
+            for nilai_khs, (huruf_mutu, angka_mutu) in zip(kurikulum_nilai_khs_list, grades):
+                nilai_khs.huruf_mutu = huruf_mutu
+                nilai_khs.angka_mutu = angka_mutu
+
+        with transaction.atomic():
+            while True:
+                try:
+                    with transaction.atomic():
+                        models.NilaiKHS.objects.bulk_create(created.values())
+                    break
+                except IntegrityError:
+                    # Another request saved some of these scores in the meantime, report those rows
+                    conflicts = set(models.NilaiKHS.objects.filter(
+                        khs_id__in={khs_id for khs_id, mata_kuliah_id in created},
+                        mata_kuliah_id__in={mata_kuliah_id for khs_id, mata_kuliah_id in created}
+                    ).values_list('khs_id', 'mata_kuliah_id')) & created.keys()
+                    if not conflicts:
+                        raise
+                    for key in conflicts:
+                        errors.append({
+                            'index': indexes[key],
+                            'errors': {'mata_kuliah': ['This "mata_kuliah" was saved by another request, submit it again']}
+                        })
+                        del created[key]
+            models.NilaiKHS.objects.bulk_update(updated.values(), ['nilai', 'huruf_mutu', 'angka_mutu'])
+            khs_ids = {khs_id for khs_id, mata_kuliah_id in [*created, *updated]}
+            refresh_khs_totals(khs_ids)
+
+        for khs_id in khs_ids:
+            invalidate_khs_pdf_cache(khs_id)
+
+        return {
+            'created': len(created),
+            'updated': len(updated),
+            'errors': sorted(errors, key=lambda error: error['index'])
+        }
+
+
 class KHSSerializer(serializers.ModelSerializer):
     mahasiswa = SimpleMahasiswaSerializer()
     tahun_akademik = serializers.SerializerMethodField()
     nilai_list = NilaiKHSSerializer(many=True)
-    ips = serializers.SerializerMethodField('calculate_ips')
+    ips = serializers.FloatField(read_only=True)
 
     def get_tahun_akademik(self, khs: models.KHS):
         return f'{khs.tahun_akademik_awal} / {khs.tahun_akademik_akhir}'
-    
-    def calculate_ips(self, khs: models.KHS):
-        sum_angka_mutu = 0
-        count_angka_mutu = 0
-        for nilai in khs.nilai_list.all():
-            count_angka_mutu += 1
-            sum_angka_mutu += nilai.angka_mutu
-
-        return round(sum_angka_mutu / count_angka_mutu, 2)
 
     class Meta:
         model = models.KHS
@@ -441,6 +625,21 @@ class KHSSerializer(serializers.ModelSerializer):
                   'program_pendidikan', 'tahun_akademik', 'ips']
 
 
+class SimpleKHSSerializer(serializers.ModelSerializer):
+    mahasiswa = SimpleMahasiswaSerializer()
+    tahun_akademik = serializers.SerializerMethodField()
+    ips = serializers.FloatField(read_only=True)
+
+    def get_tahun_akademik(self, khs: models.KHS):
+        return f'{khs.tahun_akademik_awal} / {khs.tahun_akademik_akhir}'
+
+    class Meta:
+        model = models.KHS
+        fields = ['id', 'semester', 'mahasiswa', 'kelas', 
+                  'program_studi', 'tahun_akademik', 'ips', 
+                  'total_sks', 'total_nilai_mutu', 'jumlah_mata_kuliah']
+
+
 class CreateKHSSerializer(serializers.ModelSerializer):
     def save(self, **kwargs):
         nim = self.validated_data['mahasiswa']
@@ -464,6 +663,57 @@ class CreateKHSSerializer(serializers.ModelSerializer):
                   'tahun_akademik_akhir']
 
 
+class BulkCreateKHSSerializer(serializers.Serializer):
+    kelas = serializers.PrimaryKeyRelatedField(queryset=models.Kelas.objects.all(), many=True, allow_empty=False)
+    tahun_akademik_awal = serializers.IntegerField(min_value=2000, max_value=3000)
+    tahun_akademik_akhir = serializers.IntegerField(min_value=2000, max_value=3000)
+
+    def save(self, **kwargs):
+        created = generate_khs(
+            [kelas.id for kelas in self.validated_data['kelas']],
+            self.validated_data['tahun_akademik_awal'],
+            self.validated_data['tahun_akademik_akhir']
+        )
+        return {'created': created}
+
+
+class CloneKelasSerializer(serializers.Serializer):
+    asal = serializers.PrimaryKeyRelatedField(queryset=models.Kelas.objects.all())
+    tujuan = serializers.PrimaryKeyRelatedField(queryset=models.Kelas.objects.all())
+
+
+class CloneDosenSerializer(serializers.Serializer):
+    asal = serializers.PrimaryKeyRelatedField(queryset=models.Dosen.objects.all())
+    tujuan = serializers.PrimaryKeyRelatedField(queryset=models.Dosen.objects.all())
+
+
+class CloneRuanganSerializer(serializers.Serializer):
+    asal = serializers.PrimaryKeyRelatedField(queryset=models.Ruangan.objects.all())
+    tujuan = serializers.PrimaryKeyRelatedField(queryset=models.Ruangan.objects.all())
+
+
+class CloneJadwalSerializer(serializers.Serializer):
+    kelas = CloneKelasSerializer(many=True, allow_empty=False)
+    dosen = CloneDosenSerializer(many=True, required=False)
+    ruangan = CloneRuanganSerializer(many=True, required=False)
+    replace = serializers.BooleanField(default=False)
+    move = serializers.BooleanField(default=False)
+
+    def validate_kelas(self, kelas_list):
+        targets = [kelas['tujuan'].id for kelas in kelas_list]
+        sources = [kelas['asal'].id for kelas in kelas_list]
+        if len(set(targets)) != len(targets) or len(set(sources)) != len(sources):
+            raise serializers.ValidationError('Every "kelas" can only be copied from and to once')
+        if set(targets) & set(sources):
+            raise serializers.ValidationError('A "kelas" can\'t be both a source and a target')
+        return kelas_list
+
+    def get_maps(self):
+        def to_map(field):
+            return {row['asal'].id: row['tujuan'].id for row in self.validated_data.get(field, [])}
+        return to_map('kelas'), to_map('dosen'), to_map('ruangan')
+
+
 class MateriSerializer(serializers.ModelSerializer):
     class Meta:
         model = models.Materi
@@ -0,0 +1,82 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import models
+from .jadwal_cache import invalidate_jadwal_kelas, invalidate_mahasiswa_kelas
+from .occupancy import occupancy_cache
+from .utilization import invalidate_utilisasi
+from .utils import invalidate_khs_pdf_cache, refresh_khs_totals, signatory_cache
+
+
+@receiver([post_save, post_delete], sender=models.NilaiKHS)
+def nilai_khs_changed(sender, instance, **kwargs):
+    refresh_khs_totals([instance.khs_id])
+    invalidate_khs_pdf_cache(instance.khs_id)
+
+
+@receiver(pre_save, sender=models.MataKuliah)
+def mata_kuliah_saving(sender, instance, **kwargs):
+    # The stored 'KHS' totals only depend on the SKS of a 'mata_kuliah'
+    instance.old_sks = None
+    if instance.pk is not None:
+        instance.old_sks = models.MataKuliah.objects.filter(pk=instance.pk)\
+            .values_list('jumlah_sks_teori', 'jumlah_sks_praktik').first()
+
+
+@receiver(post_save, sender=models.MataKuliah)
+def mata_kuliah_changed(sender, instance, created, **kwargs):
+    old_sks = getattr(instance, 'old_sks', None)
+    if created or old_sks is None or old_sks == (instance.jumlah_sks_teori, instance.jumlah_sks_praktik):
+        return
+    khs_ids = set(models.NilaiKHS.objects.filter(mata_kuliah=instance).values_list('khs_id', flat=True))
+    refresh_khs_totals(khs_ids)
+    for khs_id in khs_ids:
+        invalidate_khs_pdf_cache(khs_id)
+
+
+@receiver([post_save, post_delete], sender=models.Jurusan)
+@receiver([post_save, post_delete], sender=models.KetuaJurusan)
+@receiver([post_save, post_delete], sender=models.KoordinatorProgramStudi)
+@receiver([post_save, post_delete], sender=models.ProgramStudi)
+def signatory_changed(sender, instance, **kwargs):
+    # After the commit, so no worker caches the old rows again in between
+    transaction.on_commit(signatory_cache.invalidate)
+
+
+@receiver(pre_save, sender=models.JadwalMakul)
+def jadwal_makul_saving(sender, instance, **kwargs):
+    # A 'JadwalMakul' moved to another 'jadwal' also changes the timetable of its old 'kelas'
+    instance.old_jadwal_id = None
+    if instance.pk is not None:
+        instance.old_jadwal_id = models.JadwalMakul.objects.filter(pk=instance.pk).values_list('jadwal_id', flat=True).first()
+
+
+@receiver(post_save, sender=models.JadwalMakul)
+@receiver(post_delete, sender=models.JadwalMakul)
+def jadwal_makul_changed(sender, instance, **kwargs):
+    jadwal_ids = {instance.jadwal_id, getattr(instance, 'old_jadwal_id', None)}
+    kelas_ids = list(models.Jadwal.objects.filter(pk__in=jadwal_ids - {None}).values_list('kelas_id', flat=True))
+    jadwal_makul_id = instance.id
+    transaction.on_commit(lambda: occupancy_cache.publish(jadwal_makul_id))
+    transaction.on_commit(lambda: invalidate_jadwal_kelas(kelas_ids))
+    transaction.on_commit(invalidate_utilisasi)
+
+
+@receiver([post_save, post_delete], sender=models.GedungKuliah)
+@receiver([post_save, post_delete], sender=models.Ruangan)
+def ruangan_changed(sender, instance, **kwargs):
+    transaction.on_commit(invalidate_utilisasi)
+
+
+@receiver([post_save, post_delete], sender=models.Materi)
+def materi_changed(sender, instance, **kwargs):
+    kelas_ids = list(
+        models.JadwalMakul.objects.filter(id=instance.jadwal_makul_id).values_list('jadwal__kelas_id', flat=True)
+    )
+    transaction.on_commit(lambda: invalidate_jadwal_kelas(kelas_ids))
+
+
+@receiver([post_save, post_delete], sender=models.Mahasiswa)
+def mahasiswa_changed(sender, instance, **kwargs):
+    transaction.on_commit(lambda: invalidate_mahasiswa_kelas(instance.user_id))
@@ -1,3 +1,709 @@
-from django.test import TestCase
+from datetime import date, time
+from decimal import Decimal
+from io import StringIO
+import os
+import random
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.cache import cache, caches
+from django.core.cache.utils import make_template_fragment_key
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+from rest_framework_simplejwt.tokens import AccessToken
+
+from . import grading, models, scheduling, serializers, timetable, utils
+from .occupancy import OccupancyCache
+from .utilization import get_utilisasi_gedung
+from .admin import SemesterTypeFilter
+from .readers import DosenReader, MahasiswaReader
+from .search import search_mahasiswa
+
+
+class AcademicTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        jurusan = models.Jurusan.objects.create(nama='Teknik Elektro')
+        program_pendidikan = models.ProgramPendidikan.objects.create(kode='D3', nama='Diploma 3')
+        prodi = models.ProgramStudi.objects.create(
+            kode='MI', nama='Manajemen Informatika', jurusan=jurusan, program_pendidikan=program_pendidikan,
+            no_sk='123/SK/2010', tanggal_sk=date(2010, 1, 5), tahun_operasional=2010, akreditasi='B'
+        )
+        semester = models.Semester.objects.create(no=3)
+        kelas = models.Kelas.objects.create(huruf='A', prodi=prodi, semester=semester)
+        dosen = models.Dosen.objects.create(
+            nip='198001012005011001', nama='Budi', email='budi@example.com', no_hp='08123456789',
+            gelar='M.Kom', prodi=prodi
+        )
+        models.Dosen.objects.create(
+            nip='198101012005011002', nama='Sari', email='sari@example.com', no_hp='08123456780',
+            gelar='M.T', prodi=prodi, foto_profil='academic/images/sari.png'
+        )
+        models.Mahasiswa.objects.create(
+            nim='2201001', tanggal_lahir=date(2004, 2, 3), tahun_angkatan=2022, kelas=kelas,
+            pembimbing_akademik=dosen, foto_profil='academic/images/ani.png',
+            user=User.objects.create(username='ani', first_name='Ani', last_name='Lestari', email='ani@example.com')
+        )
+        models.Mahasiswa.objects.create(
+            nim='2201002', tanggal_lahir=date(2004, 5, 6), tahun_angkatan=2022, kelas=kelas,
+            user=User.objects.create(username='dewi', first_name='Dewi', last_name='', email='')
+        )
+        ruangan = models.Ruangan.objects.create(nama='R101', gedung=models.GedungKuliah.objects.create(nama='Gedung A'))
+        jadwal = models.Jadwal.objects.create(kelas=kelas)
+        for kode, hari, jam_mulai, jam_selesai in [('MI301', 'S', time(7, 30), time(9, 10)), ('MI302', 'R', time(10), time(12, 30))]:
+            mata_kuliah = models.MataKuliah.objects.create(
+                kode=kode, nama=f'Mata Kuliah {kode}', jumlah_sks_teori=1, jumlah_sks_praktik=1,
+                program_studi=prodi, semester=3
+            )
+            models.JadwalMakul.objects.create(
+                jadwal=jadwal, mata_kuliah=mata_kuliah, dosen=dosen, ruangan=ruangan,
+                hari=hari, jam_mulai=jam_mulai, jam_selesai=jam_selesai
+            )
+
+
+class FastReadTest(AcademicTestCase):
+    ''' The '.values()' readers must produce exactly what the serializers produce. '''
+
+    def setUp(self):
+        self.request = Request(APIRequestFactory().get('/academic/'))
+
+    def test_mahasiswa_reader_matches_serializer(self):
+        queryset = models.Mahasiswa.objects.order_by('nim')
+        expected = serializers.MahasiswaSerializer(queryset, many=True, context={'request': self.request}).data
+        reader = MahasiswaReader(self.request)
+        actual = reader.to_representation(reader.get_queryset(queryset))
+        self.assertEqual(actual, expected)
+
+    def test_dosen_reader_matches_serializer(self):
+        queryset = models.Dosen.objects.order_by('nip')
+        expected = serializers.DosenSerializer(queryset, many=True, context={'request': self.request}).data
+        for dosen in expected:
+            dosen['makul_ajar'] = sorted(dosen['makul_ajar'], key=lambda jadwal_makul: jadwal_makul['id'])
+        reader = DosenReader(self.request)
+        actual = reader.to_representation(reader.get_queryset(queryset))
+        self.assertEqual(actual, expected)
+
+
+class MahasiswaSearchTest(AcademicTestCase):
+    def search(self, q):
+        return list(search_mahasiswa(q).values_list('nim', flat=True))
+
+    def test_nim_prefix(self):
+        self.assertEqual(self.search('22010'), ['2201001', '2201002'])
+        self.assertEqual(self.search('2201002'), ['2201002'])
+
+    def test_name(self):
+        self.assertEqual(self.search('ani'), ['2201001'])
+        self.assertEqual(self.search('Ani Lestari'), ['2201001'])
+        self.assertEqual(self.search('dewi'), ['2201002'])
+
+    def test_empty_query(self):
+        self.assertEqual(self.search('  '), [])
+        self.assertEqual(self.search('zzzz'), [])
+
+
+class SemesterTypeTest(AcademicTestCase):
+    def test_bulk_create_sets_ganjil(self):
+        models.Semester.objects.bulk_create([models.Semester(no=4), models.Semester(no=5)])
+        self.assertEqual(dict(models.Semester.objects.values_list('no', 'ganjil')), {3: True, 4: False, 5: True})
+
+    def test_admin_filter_without_semester_row(self):
+        prodi = models.ProgramStudi.objects.get()
+        models.MataKuliah.objects.create(
+            kode='MI601', nama='Mata Kuliah MI601', jumlah_sks_teori=1, jumlah_sks_praktik=1,
+            program_studi=prodi, semester=6
+        )
+        queryset = models.MataKuliah.objects.order_by('kode')
+        odd = SemesterTypeFilter(None, {'semester_type': 'odd'}, models.MataKuliah, None).queryset(None, queryset)
+        even = SemesterTypeFilter(None, {'semester_type': 'even'}, models.MataKuliah, None).queryset(None, queryset)
+        self.assertEqual([mata_kuliah.kode for mata_kuliah in odd], ['MI301', 'MI302'])
+        self.assertEqual([mata_kuliah.kode for mata_kuliah in even], ['MI601'])
+
+
+class UserFieldsTest(AcademicTestCase):
+    def test_annotation_without_user_query(self):
+        mahasiswa = models.Mahasiswa.objects.with_user_fields().get(nim='2201001')
+        with self.assertNumQueries(0):
+            self.assertEqual(mahasiswa.nama_lengkap(), 'Ani Lestari')
+
+    def test_loaded_user_wins(self):
+        mahasiswa = models.Mahasiswa.objects.with_user_fields().get(nim='2201001')
+        mahasiswa.user.first_name = 'Anita'
+        self.assertEqual(mahasiswa.nama_depan(), 'Anita')
+
+
+class ScheduleIndexTest(SimpleTestCase):
+    def booking(self, id, jam_mulai, jam_selesai):
+        return {
+            'id': id, 'hari': 'S', 'jam_mulai': jam_mulai, 'jam_selesai': jam_selesai,
+            'ruangan_id': 1, 'dosen_id': None, 'jadwal_id': id
+        }
+
+    def test_conflict_with_earlier_long_booking(self):
+        # The index already holds two overlapping bookings, the long one ends after the previous one
+        index = scheduling.ScheduleIndex([self.booking(1, time(7), time(12)), self.booking(2, time(8), time(9))])
+        conflicts = index.conflicts(self.booking(3, time(10), time(11)))
+        self.assertEqual([conflict['jadwal_makul'] for conflict in conflicts], [[3, 1]])
+
+    def test_no_conflict_when_touching(self):
+        index = scheduling.ScheduleIndex([self.booking(1, time(7), time(9))])
+        self.assertEqual(index.conflicts(self.booking(2, time(9), time(10))), [])
+
+    def test_matches_brute_force(self):
+        generator = random.Random(1)
+        bookings = []
+        for id in range(1, 301):
+            start = generator.randrange(7 * 60, 17 * 60)
+            end = start + generator.randrange(10, 180)
+            bookings.append(self.booking(id, time(start // 60, start % 60), time(min(end // 60, 23), end % 60)))
+        index = scheduling.ScheduleIndex(bookings[:200])
+        for booking in bookings[100:150]:
+            index.remove(booking['id'])
+        remaining = bookings[:100] + bookings[150:200]
+        for booking in bookings[200:]:
+            expected = sorted(
+                other['id'] for other in remaining
+                if other['jam_mulai'] < booking['jam_selesai'] and booking['jam_mulai'] < other['jam_selesai']
+            )
+            actual = sorted(conflict['jadwal_makul'][1] for conflict in index.conflicts(booking))
+            self.assertEqual(actual, expected)
+
+
+class CloneJadwalTest(AcademicTestCase):
+    def setUp(self):
+        self.kelas = models.Kelas.objects.get(huruf='A')
+        self.target = models.Kelas.objects.create(huruf='B', prodi=self.kelas.prodi, semester=self.kelas.semester)
+
+    def test_clone_without_remapping(self):
+        # The same dosen and ruangan at the same time clash with the source timetable
+        with self.assertRaises(ValueError):
+            timetable.clone_jadwal({self.kelas.id: self.target.id})
+        self.assertFalse(models.JadwalMakul.objects.filter(jadwal__kelas=self.target).exists())
+
+    def test_clone_with_remapping(self):
+        dosen = models.Dosen.objects.get(nama='Budi')
+        ruangan = models.Ruangan.objects.get()
+        created = timetable.clone_jadwal(
+            {self.kelas.id: self.target.id},
+            {dosen.id: models.Dosen.objects.get(nama='Sari').id},
+            {ruangan.id: models.Ruangan.objects.create(nama='R102', gedung=ruangan.gedung).id}
+        )
+        self.assertEqual(len(created), 2)
+        self.assertEqual(scheduling.audit(scheduling.load_bookings()), [])
+
+    def test_move(self):
+        created = timetable.clone_jadwal({self.kelas.id: self.target.id}, move=True)
+        self.assertEqual(len(created), 2)
+        self.assertFalse(models.JadwalMakul.objects.filter(jadwal__kelas=self.kelas).exists())
+        self.assertEqual(scheduling.audit(scheduling.load_bookings()), [])
+
+    def test_command_unknown_kelas(self):
+        with self.assertRaisesMessage(CommandError, 'Kelas 999 not found'):
+            call_command('clone_timetable', '--kelas', f'{self.kelas.id}:999')
+
+
+class SolverTest(SimpleTestCase):
+    def task(self, kelas_id, mata_kuliah_id, length, dosen_ids=None):
+        return {'kelas_id': kelas_id, 'mata_kuliah_id': mata_kuliah_id, 'length': length, 'dosen_ids': dosen_ids or [None]}
+
+    def test_room_search(self):
+        # Only Senin is open and room 1 is taken in its second slot. The first task is picked first
+        # and fits in both rooms, the long one only fits in room 2.
+        occupied = {('ruangan', 1, 'S'): 0b10}
+        for hari in timetable.DAYS[1:]:
+            occupied[('kelas', 1, hari)] = occupied[('kelas', 2, hari)] = 0b11
+        problem = {
+            'tasks': [self.task(1, 1, 1), self.task(2, 2, 2, dosen_ids=[1, 2, 3])],
+            'rooms': [2, 1], 'occupied': occupied, 'slot_count': 2
+        }
+        assignments, complete = timetable.solve(problem)
+        self.assertTrue(complete)
+        self.assertEqual({assignment['mata_kuliah_id']: assignment['ruangan_id'] for assignment in assignments}, {1: 1, 2: 2})
+
+    def test_unsolvable(self):
+        # Six two-slot tasks of one kelas and only five days of two slots
+        problem = {
+            'tasks': [self.task(1, mata_kuliah_id, 2) for mata_kuliah_id in range(6)],
+            'rooms': [1], 'occupied': {}, 'slot_count': 2
+        }
+        assignments, complete = timetable.generate(problem, workers=1)
+        self.assertFalse(complete)
+        self.assertTrue(0 < len(assignments) < 6)
+        self.assertEqual(len({assignment['hari'] for assignment in assignments}), len(assignments))
+
+
+class GenerateTimetableTest(AcademicTestCase):
+    def test_generate_and_save(self):
+        kelas = models.Kelas.objects.get(huruf='A')
+        models.MataKuliah.objects.create(
+            kode='MI303', nama='Mata Kuliah MI303', jumlah_sks_teori=2, jumlah_sks_praktik=1,
+            program_studi=kelas.prodi, semester=3
+        )
+        problem = timetable.build_problem([kelas.id])
+        self.assertEqual(len(problem['tasks']), 1)
+        assignments, complete = timetable.generate(problem, workers=1)
+        self.assertTrue(complete)
+        timetable.save_assignments(assignments)
+
+        jadwal_makul_list = models.JadwalMakul.objects.filter(jadwal__kelas=kelas)
+        self.assertEqual(jadwal_makul_list.count(), 3)
+        index = scheduling.ScheduleIndex([])
+        for jadwal_makul in jadwal_makul_list:
+            booking = scheduling.booking_from_instance(jadwal_makul)
+            self.assertEqual(index.conflicts(booking), [])
+            index.add(booking)
+        # Saving the same timetable again clashes with itself
+        with self.assertRaises(ValueError):
+            timetable.save_assignments(assignments)
+
+
+class KHSPdfTest(AcademicTestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.cache_dir.cleanup)
+        cache_settings = override_settings(KHS_PDF_CACHE_DIR=self.cache_dir.name)
+        cache_settings.enable()
+        self.addCleanup(cache_settings.disable)
+        mahasiswa = models.Mahasiswa.objects.get(nim='2201001')
+        self.khs = models.KHS.objects.create(
+            mahasiswa=mahasiswa, semester=3, program_studi='Manajemen Informatika', program_pendidikan='Diploma 3',
+            tahun_akademik_awal=2023, tahun_akademik_akhir=2024, kelas='A', dosen_pembimbing='Budi M.Kom'
+        )
+        models.NilaiKHS.objects.create(
+            khs=self.khs, mata_kuliah=models.MataKuliah.objects.get(kode='MI301'),
+            nilai=85, huruf_mutu='A', angka_mutu=4
+        )
+        self.request = APIRequestFactory().get('/academic/khs/print/')
+
+    def print_pdf(self):
+        response = utils.print_khs_pdf(self.request, self.khs.id)
+        content = b''.join(response.streaming_content)
+        response.close()
+        return content
+
+    def test_render_and_cache_hit(self):
+        with mock.patch.object(utils.pisa, 'CreatePDF', wraps=utils.pisa.CreatePDF) as create_pdf:
+            first = self.print_pdf()
+            second = self.print_pdf()
+        self.assertTrue(first.startswith(b'%PDF'))
+        self.assertEqual(first, second)
+        self.assertEqual(create_pdf.call_count, 1)
+        self.assertEqual(len(os.listdir(self.cache_dir.name)), 1)
+
+    def test_signatories_read_once(self):
+        with mock.patch.object(utils.signatory_cache, 'get', wraps=utils.signatory_cache.get) as get_signatories:
+            self.print_pdf()
+        self.assertEqual(get_signatories.call_count, 1)
+
+    def test_letterhead_fragment_in_process_cache(self):
+        caches['templates'].clear()
+        context = utils.get_print_khs_context(self.khs.id)
+        key = make_template_fragment_key('khs_letterhead', [context['jurusan']['id'], context['signatory_version']])
+        utils.print_khs(self.request, self.khs.id)
+        self.assertIn('TEKNIK ELEKTRO', caches['templates'].get(key))
+
+    def test_failed_render_leaves_no_file(self):
+        with mock.patch.object(utils.pisa, 'CreatePDF', side_effect=TypeError):
+            with self.assertRaises(TypeError):
+                self.print_pdf()
+        self.assertEqual(os.listdir(self.cache_dir.name), [])
+
+
+class MeJadwalTest(AcademicTestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(get_user_model().objects.get(username='ani'))
+
+    def test_cache_hit_queries_nothing(self):
+        response = self.client.get('/academic/mahasiswa/me/jadwal/', {'hari': 'S'})
+        self.assertEqual([jadwal['mata_kuliah']['kode'] for jadwal in response.data], ['MI301'])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/academic/mahasiswa/me/jadwal/', {'hari': 'S'}).data, response.data)
+
+
+class OccupancyTest(AcademicTestCase):
+    def setUp(self):
+        cache.clear()
+        self.occupancy = OccupancyCache()
+        self.ruangan = models.Ruangan.objects.get()
+        self.jadwal_makul = models.JadwalMakul.objects.get(mata_kuliah__kode='MI301')
+
+    def is_free(self, hari='S', jam_mulai=time(8), jam_selesai=time(9)):
+        return self.occupancy.is_free(self.ruangan.id, hari, jam_mulai, jam_selesai)
+
+    def test_booked_slots(self):
+        self.assertFalse(self.is_free())
+        self.assertTrue(self.is_free(jam_mulai=time(9, 15), jam_selesai=time(10)))
+        self.assertTrue(self.is_free(hari='SE'))
+
+    def test_save_and_delete_update_only_the_changed_booking(self):
+        self.assertFalse(self.is_free())
+        with self.captureOnCommitCallbacks(execute=True):
+            self.jadwal_makul.hari = 'SE'
+            self.jadwal_makul.save()
+        # One lookup of the changed row, not a scan of the timetable
+        with self.assertNumQueries(1):
+            self.assertTrue(self.is_free())
+        self.assertFalse(self.is_free(hari='SE'))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.jadwal_makul.delete()
+        self.assertTrue(self.is_free(hari='SE'))
+        with self.assertNumQueries(0):
+            self.assertTrue(self.is_free(hari='SE'))
+
+    def test_invalidate_loads_again(self):
+        self.assertFalse(self.is_free())
+        models.JadwalMakul.objects.filter(id=self.jadwal_makul.id).update(hari='SE')
+        self.assertFalse(self.is_free())
+        self.occupancy.invalidate()
+        self.assertTrue(self.is_free())
+
+
+class TranskripTest(AcademicTestCase):
+    def test_sks_weighted_ips(self):
+        mahasiswa = models.Mahasiswa.objects.get(nim='2201001')
+        khs = models.KHS.objects.create(
+            mahasiswa=mahasiswa, semester=3, program_studi='Manajemen Informatika', program_pendidikan='Diploma 3',
+            tahun_akademik_awal=2023, tahun_akademik_akhir=2024, kelas='A'
+        )
+        mata_kuliah = models.MataKuliah.objects.create(
+            kode='MI303', nama='Mata Kuliah MI303', jumlah_sks_teori=2, jumlah_sks_praktik=1,
+            program_studi=khs.mahasiswa.kelas.prodi, semester=3
+        )
+        models.NilaiKHS.objects.create(khs=khs, mata_kuliah=models.MataKuliah.objects.get(kode='MI301'), nilai=85, huruf_mutu='A', angka_mutu=4)
+        models.NilaiKHS.objects.create(khs=khs, mata_kuliah=mata_kuliah, nilai=70, huruf_mutu='B', angka_mutu=3)
+
+        # (2 x 4 + 3 x 3) / 5, not the plain mean 3.5
+        transkrip = utils.get_transkrip(mahasiswa)
+        self.assertEqual(transkrip['semester_list'][0]['ips'], 3.4)
+        self.assertEqual(transkrip['ipk'], 3.4)
+        self.assertEqual((transkrip['total_sks'], transkrip['total_nilai_mutu']), (5, 17))
+
+
+class RuanganJadwalTest(AcademicTestCase):
+    def test_days_in_order(self):
+        ruangan = models.Ruangan.objects.get()
+        models.JadwalMakul.objects.filter(mata_kuliah__kode='MI302').update(hari='S', jam_mulai=time(10), jam_selesai=time(12))
+        models.JadwalMakul.objects.filter(mata_kuliah__kode='MI301').update(hari='J')
+        response = APIClient().get(f'/academic/ruangan/{ruangan.id}/jadwal/')
+        self.assertEqual([jadwal['nama_hari'] for jadwal in response.data], ['Senin', 'Jumat'])
+
+    def test_unknown_ruangan(self):
+        self.assertEqual(APIClient().get('/academic/ruangan/999/jadwal/').status_code, 404)
+        self.assertEqual(APIClient().get('/academic/ruangan/abc/jadwal/').status_code, 404)
+
+
+class PrintKHSKelasTest(AcademicTestCase):
+    def setUp(self):
+        self.kelas = models.Kelas.objects.get(huruf='A')
+        self.client = APIClient()
+
+    def print_kelas(self, kelas_id, **params):
+        return self.client.get('/academic/generate_pdf', {'model': 'khs', 'kelas': kelas_id, **params})
+
+    def login_staff_prodi(self, prodi):
+        user = get_user_model().objects.create(username=f'staff{prodi.id}')
+        models.StaffProdi.objects.create(no_induk=f'S{prodi.id}', no_hp='0812', prodi=prodi, user=user)
+        self.client.force_login(user)
+        return user
+
+    def test_requires_staff_prodi(self):
+        self.assertEqual(self.print_kelas(self.kelas.id).status_code, 401)
+        self.client.force_login(get_user_model().objects.get(username='ani'))
+        self.assertEqual(self.print_kelas(self.kelas.id).status_code, 403)
+
+    def test_staff_prodi_of_the_kelas(self):
+        self.login_staff_prodi(self.kelas.prodi)
+        response = self.print_kelas(self.kelas.id)
+        self.assertEqual(response.status_code, 200)
+        b''.join(response.streaming_content)
+
+    def test_jwt_header(self):
+        user = self.login_staff_prodi(self.kelas.prodi)
+        self.client.logout()
+        self.client.credentials(HTTP_X_AUTH_TOKEN=f'JWT {AccessToken.for_user(user)}')
+        self.assertEqual(self.print_kelas(self.kelas.id).status_code, 200)
+
+    def test_other_prodi(self):
+        prodi = self.kelas.prodi
+        other = models.ProgramStudi.objects.create(
+            kode='TI', nama='Teknik Informatika', jurusan=prodi.jurusan, program_pendidikan=prodi.program_pendidikan,
+            no_sk='124/SK/2010', tanggal_sk=date(2010, 1, 5), tahun_operasional=2010, akreditasi='B'
+        )
+        self.login_staff_prodi(other)
+        self.assertEqual(self.print_kelas(self.kelas.id).status_code, 404)
+
+    def test_bad_parameters(self):
+        self.login_staff_prodi(self.kelas.prodi)
+        self.assertEqual(self.print_kelas('abc').status_code, 404)
+        self.assertEqual(self.print_kelas(self.kelas.id, semester='abc').status_code, 400)
+        self.assertEqual(self.client.get('/academic/generate_pdf', {'model': 'khs', 'khs_id': 'abc'}).status_code, 404)
+
+
+class GenerateKHSTest(AcademicTestCase):
+    def setUp(self):
+        self.kelas = models.Kelas.objects.get(huruf='A')
+
+    def test_idempotent(self):
+        self.assertEqual(utils.generate_khs([self.kelas.id], 2023, 2024), 2)
+        self.assertEqual(utils.generate_khs([self.kelas.id], 2023, 2024), 0)
+        self.assertEqual(models.KHS.objects.count(), 2)
+
+    def test_concurrent_run(self):
+        # Another run creates one of the 'KHS' between the check and the insert
+        atomic = utils.transaction.atomic
+        mahasiswa = models.Mahasiswa.objects.get(nim='2201001')
+
+        def create_first(*args, **kwargs):
+            if not models.KHS.objects.exists():
+                models.KHS.objects.create(
+                    mahasiswa=mahasiswa, semester=3, tahun_akademik_awal=2023, tahun_akademik_akhir=2024,
+                    program_studi='Manajemen Informatika', program_pendidikan='Diploma 3', kelas='A'
+                )
+            return atomic(*args, **kwargs)
+
+        with mock.patch.object(utils.transaction, 'atomic', side_effect=create_first):
+            self.assertEqual(utils.generate_khs([self.kelas.id], 2023, 2024), 1)
+        self.assertEqual(models.KHS.objects.count(), 2)
+
+
+class BulkNilaiKHSTest(AcademicTestCase):
+    def setUp(self):
+        self.khs = models.KHS.objects.create(
+            mahasiswa=models.Mahasiswa.objects.get(nim='2201001'), semester=3, tahun_akademik_awal=2023,
+            tahun_akademik_akhir=2024, program_studi='Manajemen Informatika', program_pendidikan='Diploma 3', kelas='A'
+        )
+
+    def save(self, nilai_list):
+        serializer = serializers.BulkNilaiKHSSerializer(data={
+            'tahun_akademik_awal': 2023, 'tahun_akademik_akhir': 2024, 'nilai_list': nilai_list
+        })
+        serializer.is_valid(raise_exception=True)
+        return serializer.save()
+
+    def test_row_errors(self):
+        result = self.save([
+            {'nim': '2201001', 'mata_kuliah': 'MI301', 'nilai': 85},
+            'MI302',
+            {'nim': '2201002', 'mata_kuliah': 'MI301', 'nilai': 85},
+            {'nim': '2201001', 'mata_kuliah': 'XX999', 'nilai': 85},
+            {'nim': '2201001', 'mata_kuliah': 'MI302', 'nilai': 101},
+        ])
+        self.assertEqual(result['created'], 1)
+        self.assertEqual([error['index'] for error in result['errors']], [1, 2, 3, 4])
+        self.assertIn('non_field_errors', result['errors'][0]['errors'])
+        self.assertIn('nim', result['errors'][1]['errors'])
+        self.assertIn('mata_kuliah', result['errors'][2]['errors'])
+        self.assertIn('nilai', result['errors'][3]['errors'])
+
+    def test_totals_refreshed_and_resubmission_updates(self):
+        result = self.save([
+            {'nim': '2201001', 'mata_kuliah': 'MI301', 'nilai': 85},
+            {'nim': '2201001', 'mata_kuliah': 'MI302', 'nilai': 65},
+        ])
+        self.assertEqual((result['created'], result['updated']), (2, 0))
+        self.khs.refresh_from_db()
+        self.assertEqual((self.khs.total_sks, self.khs.total_nilai_mutu, self.khs.ips), (4, 12, 3))
+
+        result = self.save([{'nim': '2201001', 'mata_kuliah': 'MI302', 'nilai': 90}])
+        self.assertEqual((result['created'], result['updated'], result['errors']), (0, 1, []))
+        self.assertEqual(models.NilaiKHS.objects.filter(khs=self.khs).count(), 2)
+        self.khs.refresh_from_db()
+        self.assertEqual((self.khs.total_nilai_mutu, self.khs.ips), (16, 4))
+
+    def test_concurrent_insert(self):
+        # Another request saves the same score between the lookup and the insert
+        atomic = serializers.transaction.atomic
+        mata_kuliah = models.MataKuliah.objects.get(kode='MI301')
+
+        def create_first(*args, **kwargs):
+            if not models.NilaiKHS.objects.exists():
+                models.NilaiKHS.objects.create(khs=self.khs, mata_kuliah=mata_kuliah, nilai=70, huruf_mutu='B', angka_mutu=3)
+            return atomic(*args, **kwargs)
+
+        with mock.patch.object(serializers.transaction, 'atomic', side_effect=create_first):
+            result = self.save([
+                {'nim': '2201001', 'mata_kuliah': 'MI301', 'nilai': 85},
+                {'nim': '2201001', 'mata_kuliah': 'MI302', 'nilai': 85},
+            ])
+        self.assertEqual(result['created'], 1)
+        self.assertEqual([error['index'] for error in result['errors']], [0])
+        self.assertEqual(models.NilaiKHS.objects.get(khs=self.khs, mata_kuliah=mata_kuliah).nilai, 70)
+
+
+class GradingTest(AcademicTestCase):
+    def setUp(self):
+        self.kurikulum = models.Kurikulum.objects.create(kode='K2023', nama='Kurikulum 2023', tanggal_digunakan=date(2023, 8, 1))
+        for huruf_mutu, angka_mutu, nilai_minimum in [('A', 4, 85), ('B', 3, 75), ('C', 2, 0)]:
+            models.SkalaNilai.objects.create(
+                kurikulum=self.kurikulum, huruf_mutu=huruf_mutu, angka_mutu=angka_mutu, nilai_minimum=nilai_minimum
+            )
+
+    def test_boundaries(self):
+        scale = grading.GradingScale(grading.DEFAULT_SKALA_NILAI)
+        self.assertEqual(
+            scale.convert_many([Decimal('79.5'), Decimal('79.99'), Decimal(80), Decimal(100), Decimal('49.99'), Decimal(1)]),
+            [('B', 3), ('B', 3), ('A', 4), ('A', 4), ('E', 0), ('E', 0)]
+        )
+
+    def test_scale_per_kurikulum(self):
+        with self.assertNumQueries(1):
+            scales = grading.get_grading_scales([self.kurikulum.id, None])
+        self.assertEqual(scales[self.kurikulum.id].convert(Decimal(80)), ('B', 3))
+        self.assertEqual(scales[None].convert(Decimal(80)), ('A', 4))
+
+    def test_regrade_command(self):
+        mata_kuliah = models.MataKuliah.objects.get(kode='MI301')
+        khs = models.KHS.objects.create(
+            mahasiswa=models.Mahasiswa.objects.get(nim='2201001'), semester=3, tahun_akademik_awal=2023,
+            tahun_akademik_akhir=2024, program_studi='Manajemen Informatika', program_pendidikan='Diploma 3', kelas='A'
+        )
+        models.NilaiKHS.objects.create(khs=khs, mata_kuliah=mata_kuliah, nilai=Decimal('79.5'), huruf_mutu='A', angka_mutu=4)
+        models.MataKuliah.objects.filter(pk=mata_kuliah.pk).update(kurikulum=self.kurikulum)
+
+        out = StringIO()
+        call_command('regrade_nilai_khs', '2023', '--semester', '3', stdout=out)
+        self.assertIn('1 KHS regraded', out.getvalue())
+        nilai_khs = models.NilaiKHS.objects.get(khs=khs)
+        self.assertEqual((nilai_khs.huruf_mutu, nilai_khs.angka_mutu), ('B', 3))
+        khs.refresh_from_db()
+        self.assertEqual((khs.total_nilai_mutu, khs.ips), (6, 3))
+
+
+class KHSTotalsTest(AcademicTestCase):
+    def setUp(self):
+        self.khs = models.KHS.objects.create(
+            mahasiswa=models.Mahasiswa.objects.get(nim='2201001'), semester=3, tahun_akademik_awal=2023,
+            tahun_akademik_akhir=2024, program_studi='Manajemen Informatika', program_pendidikan='Diploma 3', kelas='A'
+        )
+        self.mata_kuliah = models.MataKuliah.objects.get(kode='MI301')
+        self.nilai_khs = models.NilaiKHS.objects.create(
+            khs=self.khs, mata_kuliah=self.mata_kuliah, nilai=85, huruf_mutu='A', angka_mutu=4
+        )
+        models.NilaiKHS.objects.create(
+            khs=self.khs, mata_kuliah=models.MataKuliah.objects.get(kode='MI302'), nilai=65, huruf_mutu='C', angka_mutu=2
+        )
+
+    def assertTotals(self, total_sks, total_nilai_mutu, ips):
+        self.khs.refresh_from_db()
+        self.assertEqual((self.khs.total_sks, self.khs.total_nilai_mutu, self.khs.ips), (total_sks, total_nilai_mutu, ips))
+
+    def test_nilai_khs_changed(self):
+        self.assertTotals(4, 12, 3)
+        self.nilai_khs.angka_mutu = 2
+        self.nilai_khs.save()
+        self.assertTotals(4, 8, 2)
+        self.nilai_khs.delete()
+        self.assertTotals(2, 4, 2)
+
+    def test_mata_kuliah_sks_changed(self):
+        self.mata_kuliah.jumlah_sks_teori = 3
+        self.mata_kuliah.save()
+        self.assertTotals(6, 20, Decimal('3.33'))
+
+    def test_mata_kuliah_other_field_changed(self):
+        self.mata_kuliah.nama = 'Basis Data'
+        with mock.patch('academic.signals.refresh_khs_totals') as refresh:
+            self.mata_kuliah.save()
+        refresh.assert_not_called()
+
+
+class DosenJadwalETagTest(AcademicTestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(get_user_model().objects.get(username='ani'))
+        self.url = f'/academic/dosen/{models.Dosen.objects.get(nama="Budi").nip}/jadwal/'
+
+    def test_not_modified(self):
+        etag = self.client.get(self.url)['ETag']
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_renamed_ruangan_changes_etag(self):
+        etag = self.client.get(self.url)['ETag']
+        models.Ruangan.objects.update(nama='R102')
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+class UtilisasiTest(AcademicTestCase):
+    def setUp(self):
+        cache.clear()
+        self.gedung = models.GedungKuliah.objects.get()
+
+    def test_cached_until_jadwal_changes(self):
+        report = get_utilisasi_gedung(self.gedung)
+        self.assertEqual(report['ruangan_list'][0]['total_jam'], 4.17)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_utilisasi_gedung(self.gedung), report)
+
+        jadwal_makul = models.JadwalMakul.objects.get(mata_kuliah__kode='MI302')
+        jadwal_makul.jam_selesai = time(11)
+        with self.captureOnCommitCallbacks(execute=True):
+            jadwal_makul.save()
+        self.assertEqual(get_utilisasi_gedung(self.gedung)['ruangan_list'][0]['total_jam'], 2.67)
+
+    def test_renamed_ruangan(self):
+        get_utilisasi_gedung(self.gedung)
+        ruangan = models.Ruangan.objects.get()
+        ruangan.nama = 'R102'
+        with self.captureOnCommitCallbacks(execute=True):
+            ruangan.save()
+        self.assertEqual(get_utilisasi_gedung(self.gedung)['ruangan_list'][0]['nama'], 'R102')
+
+
+class PaginationTest(AcademicTestCase):
+    def setUp(self):
+        user = get_user_model().objects.create(username='staff')
+        models.StaffProdi.objects.create(no_induk='S1', no_hp='0812', prodi=models.ProgramStudi.objects.get(), user=user)
+        self.client = APIClient()
+        self.client.force_authenticate(user)
+
+    def test_default_shape(self):
+        response = self.client.get('/academic/mahasiswa/')
+        self.assertEqual(list(response.data), ['count', 'next', 'previous', 'results'])
+        self.assertEqual(response.data['count'], 2)
+        self.assertEqual([mahasiswa['nim'] for mahasiswa in response.data['results']], ['2201001', '2201002'])
+
+    def test_page_size(self):
+        response = self.client.get('/academic/mahasiswa/', {'page_size': 1})
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertIsNotNone(response.data['next'])
+        response = self.client.get(response.data['next'])
+        self.assertEqual([mahasiswa['nim'] for mahasiswa in response.data['results']], ['2201002'])
+        self.assertIsNone(response.data['next'])
+
+
+class SparseFieldsTest(AcademicTestCase):
+    def setUp(self):
+        user = get_user_model().objects.create(username='staff')
+        models.StaffProdi.objects.create(no_induk='S1', no_hp='0812', prodi=models.ProgramStudi.objects.get(), user=user)
+        self.client = APIClient()
+        self.client.force_authenticate(user)
+        self.user_table = get_user_model()._meta.db_table
+
+    def get_mahasiswa(self, fields):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/academic/mahasiswa/', {'fields': fields})
+        mahasiswa_queries = [query['sql'] for query in queries if 'academic_mahasiswa' in query['sql']]
+        return response.data['results'], mahasiswa_queries
+
+    def test_fields_without_user(self):
+        results, mahasiswa_queries = self.get_mahasiswa('nim,tahun_angkatan')
+        self.assertEqual(results[0], {'nim': '2201001', 'tahun_angkatan': 2022})
+        self.assertTrue(mahasiswa_queries)
+        self.assertFalse(any(self.user_table in sql for sql in mahasiswa_queries))
+
+    def test_fields_with_user(self):
+        results, mahasiswa_queries = self.get_mahasiswa('nim,nama_depan')
+        self.assertEqual(results[0], {'nim': '2201001', 'nama_depan': 'Ani'})
+        self.assertTrue(any(self.user_table in sql for sql in mahasiswa_queries))
@@ -0,0 +1,389 @@
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import datetime, timedelta
+import multiprocessing
+import random
+import time
+
+from django.db import transaction
+from django.db.models import Q
+
+from . import models, scheduling
+from .jadwal_cache import invalidate_jadwal_kelas
+from .occupancy import occupancy_cache
+from .utilization import invalidate_utilisasi
+
+DAY_START = scheduling.DAY_START
+DAY_END = scheduling.DAY_END
+
+# Every slot is one SKS long, a 'mata_kuliah' takes as many consecutive slots as its SKS
+MINUTES_PER_SKS = 50
+
+DAYS = [hari for hari, nama in models.JadwalMakul.HARI_CHOICES]
+
+
+def get_slot_count():
+    minutes = (datetime.combine(datetime.min, DAY_END) - datetime.combine(datetime.min, DAY_START)).seconds // 60
+    return minutes // MINUTES_PER_SKS
+
+
+def slot_to_time(slot):
+    return (datetime.combine(datetime.min, DAY_START) + timedelta(minutes=slot * MINUTES_PER_SKS)).time()
+
+
+def time_to_slot(value, round_up=False):
+    minutes = (datetime.combine(datetime.min, value) - datetime.combine(datetime.min, DAY_START)).total_seconds() / 60
+    slot = minutes / MINUTES_PER_SKS
+    slot = int(-(-slot // 1)) if round_up else int(slot // 1)
+    return min(max(slot, 0), get_slot_count())
+
+
+def get_mask(start, length):
+    return ((1 << length) - 1) << start
+
+
+def build_problem(kelas_ids, ruangan_ids=None):
+    '''
+    Collects everything the solver needs with a handful of queries: the 'mata_kuliah' of every
+    'kelas' that aren't scheduled yet, the candidate 'dosen' of every 'mata_kuliah', the rooms and
+    the slots already taken by the existing timetable. The result only holds plain values, so it
+    can be sent to other processes.
+    '''
+    kelas_list = list(models.Kelas.objects.filter(id__in=kelas_ids).values('id', 'prodi_id', 'semester_id', 'kurikulum_id'))
+    scheduled = set(
+        models.JadwalMakul.objects\
+            .filter(jadwal__kelas_id__in=kelas_ids)\
+            .values_list('jadwal__kelas_id', 'mata_kuliah_id')
+    )
+    mata_kuliah_list = {}
+    for mata_kuliah in models.MataKuliah.objects\
+            .filter(program_studi_id__in={kelas['prodi_id'] for kelas in kelas_list})\
+            .values('id', 'program_studi_id', 'semester', 'kurikulum_id', 'jumlah_sks_teori', 'jumlah_sks_praktik'):
+        key = (mata_kuliah['program_studi_id'], mata_kuliah['semester'], mata_kuliah['kurikulum_id'])
+        mata_kuliah_list.setdefault(key, []).append(mata_kuliah)
+
+    dosen_makul = {}
+    for mata_kuliah_id, dosen_id in models.JadwalMakul.objects\
+            .filter(dosen__isnull=False)\
+            .values_list('mata_kuliah_id', 'dosen_id')\
+            .distinct():
+        dosen_makul.setdefault(mata_kuliah_id, set()).add(dosen_id)
+    dosen_prodi = {}
+    for dosen_id, prodi_id in models.Dosen.objects.values_list('id', 'prodi_id'):
+        dosen_prodi.setdefault(prodi_id, []).append(dosen_id)
+
+    tasks = []
+    for kelas in kelas_list:
+        for mata_kuliah in mata_kuliah_list.get((kelas['prodi_id'], kelas['semester_id'], kelas['kurikulum_id']), []):
+            length = mata_kuliah['jumlah_sks_teori'] + mata_kuliah['jumlah_sks_praktik']
+            if (kelas['id'], mata_kuliah['id']) in scheduled or not length:
+                continue
+            dosen_ids = sorted(dosen_makul.get(mata_kuliah['id'], [])) or dosen_prodi.get(kelas['prodi_id'], [])
+            tasks.append({
+                'kelas_id': kelas['id'],
+                'mata_kuliah_id': mata_kuliah['id'],
+                'length': length,
+                'dosen_ids': dosen_ids or [None]
+            })
+
+    rooms = models.Ruangan.objects.all()
+    if ruangan_ids:
+        rooms = rooms.filter(id__in=ruangan_ids)
+    rooms = list(rooms.values_list('id', flat=True))
+
+    occupied = {}
+    for booking in models.JadwalMakul.objects.values('hari', 'jam_mulai', 'jam_selesai', 'ruangan_id', 'dosen_id', 'jadwal__kelas_id'):
+        start = time_to_slot(booking['jam_mulai'])
+        end = time_to_slot(booking['jam_selesai'], round_up=True)
+        if end <= start:
+            continue
+        mask = get_mask(start, end - start)
+        for key in [('ruangan', booking['ruangan_id']), ('dosen', booking['dosen_id']), ('kelas', booking['jadwal__kelas_id'])]:
+            if key[1] is not None:
+                occupied[(*key, booking['hari'])] = occupied.get((*key, booking['hari']), 0) | mask
+
+    return {'tasks': tasks, 'rooms': rooms, 'occupied': occupied, 'slot_count': get_slot_count()}
+
+
+class Solver:
+    '''
+    Assigns a day, a start slot, a 'dosen' and a 'ruangan' to every task with a depth-first search.
+    The next task is always the one with the fewest values left (MRV), and every assignment removes
+    the values it makes impossible from the other tasks, including the ones left without a free room
+    (forward checking), so dead ends are found before the search walks into them. The rooms are part
+    of the search, a value is tried again in another room when the first one leads to a dead end.
+    '''
+    def __init__(self, problem, seed=0):
+        self.tasks = problem['tasks']
+        self.occupied = dict(problem['occupied'])
+        self.slot_count = problem['slot_count']
+        self.random = random.Random(seed)
+        self.rooms = list(problem['rooms'])
+        if seed:
+            self.random.shuffle(self.rooms)
+
+        self.domains = [
+            [
+                (hari, start, dosen_id)
+                for hari in DAYS
+                for start in range(self.slot_count - task['length'] + 1)
+                for dosen_id in task['dosen_ids']
+            ] for task in self.tasks
+        ]
+        self.domains = [
+            [value for value in domain if self.fits(index, value)]
+            for index, domain in enumerate(self.domains)
+        ]
+
+    def is_free(self, key, mask):
+        return not self.occupied.get(key, 0) & mask
+
+    def fits(self, index, value):
+        hari, start, dosen_id = value
+        mask = get_mask(start, self.tasks[index]['length'])
+        return self.is_free(('kelas', self.tasks[index]['kelas_id'], hari), mask) and \
+            (dosen_id is None or self.is_free(('dosen', dosen_id, hari), mask)) and \
+            any(self.is_free(('ruangan', ruangan_id, hari), mask) for ruangan_id in self.rooms)
+
+    def get_rooms(self, index, value):
+        '''
+        The free rooms for the value. Rooms that are booked the same way on that day are
+        interchangeable for the rest of the search, so only the first of them is returned.
+        '''
+        hari, start, dosen_id = value
+        mask = get_mask(start, self.tasks[index]['length'])
+        seen = set()
+        for ruangan_id in self.rooms:
+            booked = self.occupied.get(('ruangan', ruangan_id, hari), 0)
+            if not booked & mask and booked not in seen:
+                seen.add(booked)
+                yield ruangan_id
+
+    def get_candidates(self, index):
+        for value in self.order_values(index):
+            if self.fits(index, value):
+                for ruangan_id in self.get_rooms(index, value):
+                    yield value, ruangan_id
+
+    def get_keys(self, index, value, ruangan_id):
+        hari, start, dosen_id = value
+        keys = [('kelas', self.tasks[index]['kelas_id'], hari), ('ruangan', ruangan_id, hari)]
+        if dosen_id is not None:
+            keys.append(('dosen', dosen_id, hari))
+        return keys
+
+    def assign(self, index, value, ruangan_id, unassigned):
+        ''' Books the slots and prunes the other domains. Returns the trail to undo it, or None on a dead end. '''
+        hari, start, dosen_id = value
+        mask = get_mask(start, self.tasks[index]['length'])
+        for key in self.get_keys(index, value, ruangan_id):
+            self.occupied[key] = self.occupied.get(key, 0) | mask
+        trail = []
+        for other in unassigned:
+            if other == index:
+                continue
+            # Only the values overlapping the booked slots can stop fitting
+            domain = [
+                other_value for other_value in self.domains[other]
+                if other_value[0] != hari
+                or not get_mask(other_value[1], self.tasks[other]['length']) & mask
+                or self.fits(other, other_value)
+            ]
+            if len(domain) != len(self.domains[other]):
+                trail.append((other, self.domains[other]))
+                self.domains[other] = domain
+            if not domain:
+                self.unassign(index, value, ruangan_id, trail)
+                return None
+        return trail
+
+    def unassign(self, index, value, ruangan_id, trail):
+        mask = get_mask(value[1], self.tasks[index]['length'])
+        for key in self.get_keys(index, value, ruangan_id):
+            self.occupied[key] &= ~mask
+        for other, domain in reversed(trail):
+            self.domains[other] = domain
+
+    def order_values(self, index):
+        values = list(self.domains[index])
+        if self.random.random() < 0.5 and len(values) > 1:
+            self.random.shuffle(values)
+        return values
+
+    def solve(self, deadline=None, stop_event=None):
+        '''
+        Returns (assignments, complete). When the time budget runs out the largest conflict-free
+        partial assignment found so far is returned with 'complete' set to False.
+        '''
+        unassigned = set(range(len(self.tasks)))
+        stack = []
+        best = []
+        steps = 0
+        select_next = True
+
+        while unassigned:
+            steps += 1
+            if steps % 1000 == 0:
+                if (deadline and time.monotonic() > deadline) or (stop_event and stop_event.is_set()):
+                    return best, False
+
+            if select_next:
+                index = min(unassigned, key=lambda task: len(self.domains[task]))
+                stack.append({'index': index, 'candidates': self.get_candidates(index), 'assigned': None})
+
+            frame = stack[-1]
+            select_next = False
+            for value, ruangan_id in frame['candidates']:
+                trail = self.assign(frame['index'], value, ruangan_id, unassigned)
+                if trail is None:
+                    continue
+                frame['assigned'] = (value, ruangan_id, trail)
+                unassigned.discard(frame['index'])
+                select_next = True
+                break
+
+            if select_next:
+                if len(stack) > len(best):
+                    best = self.get_assignments(stack)
+                continue
+
+            # Every value and room of this task failed, go back to the previous task and try its next value
+            stack.pop()
+            if not stack:
+                return best, False
+            previous = stack[-1]
+            value, ruangan_id, trail = previous['assigned']
+            self.unassign(previous['index'], value, ruangan_id, trail)
+            previous['assigned'] = None
+            unassigned.add(previous['index'])
+
+        return self.get_assignments(stack), True
+
+    def get_assignments(self, stack):
+        assignments = []
+        for frame in stack:
+            if not frame['assigned']:
+                continue
+            (hari, start, dosen_id), ruangan_id, trail = frame['assigned']
+            task = self.tasks[frame['index']]
+            assignments.append({
+                'kelas_id': task['kelas_id'],
+                'mata_kuliah_id': task['mata_kuliah_id'],
+                'hari': hari,
+                'jam_mulai': slot_to_time(start),
+                'jam_selesai': slot_to_time(start + task['length']),
+                'ruangan_id': ruangan_id,
+                'dosen_id': dosen_id
+            })
+        return assignments
+
+
+def solve(problem, seed=0, deadline=None, stop_event=None):
+    return Solver(problem, seed).solve(deadline, stop_event)
+
+
+def generate(problem, time_budget=60, workers=1):
+    '''
+    Runs the solver with a different seed in every worker process and returns the first complete
+    timetable, or the largest partial one when none is found within 'time_budget' seconds.
+    '''
+    deadline = time.monotonic() + time_budget
+    if workers <= 1:
+        return solve(problem, deadline=deadline)
+
+    best = ([], False)
+    with multiprocessing.Manager() as manager:
+        stop_event = manager.Event()
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            pending = {
+                executor.submit(solve, problem, seed, deadline, stop_event)
+                for seed in range(workers)
+            }
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    assignments, complete = future.result()
+                    if complete:
+                        stop_event.set()
+                        return assignments, complete
+                    if len(assignments) > len(best[0]):
+                        best = (assignments, complete)
+    return best
+
+
+def save_assignments(assignments):
+    '''
+    Writes the generated 'JadwalMakul' in one transaction. The 'Jadwal' of every 'kelas' is created
+    when it doesn't exist yet, and the rows are checked again against the timetable in the database
+    in case it changed while the solver was running.
+    '''
+    with transaction.atomic():
+        kelas_ids = {assignment['kelas_id'] for assignment in assignments}
+        jadwal_list = dict(models.Jadwal.objects.filter(kelas_id__in=kelas_ids).values_list('kelas_id', 'id'))
+        models.Jadwal.objects.bulk_create([
+            models.Jadwal(kelas_id=kelas_id) for kelas_id in kelas_ids if kelas_id not in jadwal_list
+        ])
+        jadwal_list = dict(models.Jadwal.objects.filter(kelas_id__in=kelas_ids).values_list('kelas_id', 'id'))
+
+        jadwal_makul_list = [
+            models.JadwalMakul(
+                jadwal_id=jadwal_list[assignment['kelas_id']],
+                mata_kuliah_id=assignment['mata_kuliah_id'],
+                hari=assignment['hari'],
+                jam_mulai=assignment['jam_mulai'],
+                jam_selesai=assignment['jam_selesai'],
+                ruangan_id=assignment['ruangan_id'],
+                dosen_id=assignment['dosen_id']
+            ) for assignment in assignments
+        ]
+        bookings = [scheduling.booking_from_instance(jadwal_makul) for jadwal_makul in jadwal_makul_list]
+        index = scheduling.ScheduleIndex.from_queryset(
+            models.JadwalMakul.objects.filter(
+                Q(ruangan_id__in={booking['ruangan_id'] for booking in bookings}) |
+                Q(dosen_id__in={booking['dosen_id'] for booking in bookings if booking['dosen_id']}) |
+                Q(jadwal_id__in=jadwal_list.values())
+            )
+        )
+        conflicts = []
+        for booking in bookings:
+            conflicts += index.conflicts(booking)
+            index.add(booking)
+        if conflicts:
+            raise ValueError('; '.join(scheduling.describe_conflict(conflict) for conflict in conflicts))
+
+        created = models.JadwalMakul.objects.bulk_create(jadwal_makul_list)
+        transaction.on_commit(occupancy_cache.invalidate)
+        transaction.on_commit(lambda: invalidate_jadwal_kelas(kelas_ids))
+        transaction.on_commit(invalidate_utilisasi)
+        return created
+
+
+def clone_jadwal(kelas_map, dosen_map=None, ruangan_map=None, replace=False, move=False):
+    '''
+    Copies the 'JadwalMakul' of every source 'kelas' to its target 'kelas' ({source_id: target_id}),
+    swapping 'dosen' and 'ruangan' through the optional {old_id: new_id} maps. With 'replace' the
+    existing 'JadwalMakul' of the target 'kelas' are deleted first. The copies are checked and written
+    like a generated timetable, in one transaction, the source timetable included, so a 'dosen' or
+    'ruangan' that isn't swapped clashes with its source. With 'move' the source 'JadwalMakul' are
+    deleted in the same transaction instead, the timetable moves to the target 'kelas'.
+    '''
+    dosen_map = dosen_map or {}
+    ruangan_map = ruangan_map or {}
+    assignments = [
+        {
+            'kelas_id': kelas_map[row['jadwal__kelas_id']],
+            'mata_kuliah_id': row['mata_kuliah_id'],
+            'hari': row['hari'],
+            'jam_mulai': row['jam_mulai'],
+            'jam_selesai': row['jam_selesai'],
+            'ruangan_id': ruangan_map.get(row['ruangan_id'], row['ruangan_id']),
+            'dosen_id': dosen_map.get(row['dosen_id'], row['dosen_id'])
+        } for row in models.JadwalMakul.objects\
+            .filter(jadwal__kelas_id__in=kelas_map)\
+            .values('jadwal__kelas_id', 'mata_kuliah_id', 'hari', 'jam_mulai', 'jam_selesai', 'ruangan_id', 'dosen_id')
+    ]
+    with transaction.atomic():
+        if replace:
+            models.JadwalMakul.objects.filter(jadwal__kelas_id__in=kelas_map.values()).delete()
+        if move:
+            models.JadwalMakul.objects.filter(jadwal__kelas_id__in=kelas_map).delete()
+        return save_assignments(assignments)
@@ -0,0 +1,118 @@
+from datetime import datetime, time
+
+from django.core.cache import cache
+from django.db.models import Count, DurationField, ExpressionWrapper, F, Q, Sum
+
+from . import models
+from .scheduling import DAY_END, DAY_START
+
+CACHE_TIMEOUT = 60 * 60 * 24
+
+VERSION_KEY = 'academic:utilisasi_version'
+
+DURASI = ExpressionWrapper(F('jam_selesai') - F('jam_mulai'), output_field=DurationField())
+
+
+def get_jam_operasional():
+    return (datetime.combine(datetime.min, DAY_END) - datetime.combine(datetime.min, DAY_START)).seconds / 3600
+
+
+def get_version():
+    return cache.get_or_set(VERSION_KEY, 1, None)
+
+
+def invalidate_utilisasi():
+    '''
+    Every cached report goes stale at once by bumping the version in their keys. The version lives
+    in the shared cache, so every worker sees the bump.
+    '''
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, 1, None)
+
+
+def to_hours(durasi):
+    return round(durasi.total_seconds() / 3600, 2) if durasi else 0
+
+
+def get_utilisasi_gedung(gedung):
+    key = f'academic:utilisasi:{gedung.id}:{get_version()}'
+    data = cache.get(key)
+    if data is None:
+        data = build_utilisasi_gedung(gedung)
+        cache.set(key, data, CACHE_TIMEOUT)
+    return data
+
+
+def build_utilisasi_gedung(gedung):
+    '''
+    Reports how the rooms of a 'gedung' are used. The booked hours of every room and day and the
+    number of busy rooms in every hour of every day are summed by the database, Python only
+    arranges the aggregated rows.
+    '''
+    nama_hari = dict(models.JadwalMakul.HARI_CHOICES)
+    jam_operasional = get_jam_operasional()
+    jadwal_makul_list = models.JadwalMakul.objects.filter(ruangan__gedung_id=gedung.id)
+
+    ruangan_list = {
+        ruangan['id']: {
+            'id': ruangan['id'],
+            'nama': ruangan['nama'],
+            'total_jam': 0,
+            'utilisasi': 0,
+            'hari_list': []
+        } for ruangan in models.Ruangan.objects.filter(gedung_id=gedung.id).order_by('nama').values('id', 'nama')
+    }
+    for row in jadwal_makul_list\
+            .values('ruangan_id', 'hari')\
+            .annotate(durasi=Sum(DURASI), jumlah_jadwal=Count('id'))\
+            .order_by():
+        ruangan = ruangan_list[row['ruangan_id']]
+        jam = to_hours(row['durasi'])
+        ruangan['total_jam'] += jam
+        ruangan['hari_list'].append({
+            'hari': row['hari'],
+            'nama_hari': nama_hari[row['hari']],
+            'jam': jam,
+            'jumlah_jadwal': row['jumlah_jadwal'],
+            'utilisasi': round(jam / jam_operasional * 100, 2)
+        })
+    days = list(nama_hari)
+    for ruangan in ruangan_list.values():
+        ruangan['total_jam'] = round(ruangan['total_jam'], 2)
+        ruangan['utilisasi'] = round(ruangan['total_jam'] / (jam_operasional * len(days)) * 100, 2)
+        ruangan['hari_list'].sort(key=lambda hari: days.index(hari['hari']))
+
+    # One filtered count per hour, each counting the rooms with a booking overlapping that hour
+    hours = list(range(DAY_START.hour, DAY_END.hour + (1 if DAY_END.minute else 0)))
+    buckets = {
+        f'jam_{hour:02d}': Count('ruangan', distinct=True, filter=Q(
+            jam_mulai__lt=time(hour + 1), jam_selesai__gt=time(hour)
+        )) for hour in hours
+    }
+    jam_sibuk_list = []
+    for row in jadwal_makul_list.values('hari').annotate(**buckets).order_by():
+        counts = [(row[f'jam_{hour:02d}'], hour) for hour in hours]
+        jumlah_ruangan = max(count for count, hour in counts)
+        jam_sibuk_list.append({
+            'hari': row['hari'],
+            'nama_hari': nama_hari[row['hari']],
+            'jumlah_ruangan': jumlah_ruangan,
+            'jam_list': [f'{hour:02d}:00' for count, hour in counts if count == jumlah_ruangan and count],
+            'per_jam': {f'{hour:02d}:00': count for count, hour in counts}
+        })
+    jam_sibuk_list.sort(key=lambda hari: days.index(hari['hari']))
+
+    ruangan_sorted = sorted(ruangan_list.values(), key=lambda ruangan: -ruangan['total_jam'])
+    return {
+        'gedung': {'id': gedung.id, 'nama': gedung.nama},
+        'jam_operasional': jam_operasional,
+        'jumlah_ruangan': len(ruangan_list),
+        'ruangan_list': ruangan_sorted,
+        'jam_sibuk_list': jam_sibuk_list,
+        'ruangan_kosong_list': [
+            {'id': ruangan['id'], 'nama': ruangan['nama']}
+            for ruangan in ruangan_list.values() if not ruangan['hari_list']
+        ]
+    }
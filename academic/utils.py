@@ -1,5 +1,18 @@
-from datetime import datetime
-from django.shortcuts import render
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from glob import glob
+import hashlib
+import os
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, FloatField, Sum
+from django.db.models.functions import Cast, NullIf
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404, render
+from django.template.loader import get_template, render_to_string
+from xhtml2pdf import pisa
 
 from . import models
 
@@ -18,31 +31,81 @@ months_in_bahasa = {
     '12': 'Desember'
 }
 
-def print_khs(request, khs_id):
-    khs = models.KHS.objects.filter(pk=khs_id).first()
-    ketua_jurusan = models.KetuaJurusan.objects.filter(jurusan__id=khs.mahasiswa.kelas.prodi.jurusan.id).first()
-    koordinator_prodi = models.KoordinatorProgramStudi.objects.filter(program_studi__nama=khs.program_studi).first()
-    khs_scores = [score for score in khs.nilai_list.all()]
-    sks_total = 0
-    total_score = 0
-    quality_value_total = 0
-    for score in khs_scores:
-        sks = score.mata_kuliah.jumlah_sks_teori + score.mata_kuliah.jumlah_sks_praktik
-        sks_total += sks
-        total_score += score.angka_mutu
-        quality_value_total += (score.angka_mutu * sks)
-    
-    ips = round(total_score / len(khs_scores), 2)
-    status = 'LULUS' if ips > 2 else 'TIDAK LULUS'
+class SignatoryCache:
+    '''
+    Keeps the 'Jurusan', 'KetuaJurusan' and 'KoordinatorProgramStudi' of every 'program studi'
+    in the Django cache, keyed by the 'program studi' name stored in the 'KHS'. It is loaded with
+    three queries on first use and goes stale when the save/delete signals of the models it depends
+    on bump the version in its key, which every worker sharing the cache sees.
+    '''
+    TIMEOUT = 60 * 60
+    VERSION_KEY = 'academic:signatory_version'
+
+    @property
+    def version(self):
+        return cache.get_or_set(self.VERSION_KEY, 1, None)
+
+    def load(self):
+        ketua_jurusan_list = {}
+        for ketua_jurusan in models.KetuaJurusan.objects.order_by('id').values('jurusan_id', 'nama', 'gelar', 'nomor_induk'):
+            ketua_jurusan_list.setdefault(ketua_jurusan.pop('jurusan_id'), ketua_jurusan)
+        koordinator_prodi_list = {}
+        for koordinator_prodi in models.KoordinatorProgramStudi.objects.order_by('id').values('program_studi_id', 'nama', 'gelar', 'nomor_induk'):
+            koordinator_prodi_list.setdefault(koordinator_prodi.pop('program_studi_id'), koordinator_prodi)
+        return {
+            prodi['nama']: {
+                'jurusan': {'id': prodi['jurusan_id'], 'nama': prodi['jurusan__nama']} if prodi['jurusan_id'] else None,
+                'ketua_jurusan': ketua_jurusan_list.get(prodi['jurusan_id']),
+                'koordinator_prodi': koordinator_prodi_list.get(prodi['id'])
+            } for prodi in models.ProgramStudi.objects.values('id', 'nama', 'jurusan_id', 'jurusan__nama')
+        }
+
+    def get_all(self):
+        version = self.version
+        key = f'academic:signatories:{version}'
+        signatories = cache.get(key)
+        if signatories is None:
+            signatories = self.load()
+            cache.set(key, signatories, self.TIMEOUT)
+        return version, signatories
+
+    def get(self, program_studi):
+        '''
+        Returns the 'jurusan', 'ketua_jurusan' and 'koordinator_prodi' of a 'program studi' name,
+        with the 'signatory_version' they were loaded at for the template fragment keys.
+        '''
+        version, signatories = self.get_all()
+        return {
+            'jurusan': None, 'ketua_jurusan': None, 'koordinator_prodi': None,
+            **signatories.get(program_studi, {}),
+            'signatory_version': version
+        }
+
+    def invalidate(self):
+        try:
+            cache.incr(self.VERSION_KEY)
+        except ValueError:
+            cache.set(self.VERSION_KEY, 1, None)
+
+
+signatory_cache = SignatoryCache()
+
+
+def get_today_date():
     today = datetime.today()
-    today_date = f'{today.day} {months_in_bahasa[str(today.month)]} {today.year}'
+    return f'{today.day} {months_in_bahasa[str(today.month)]} {today.year}'
+
+
+def get_khs_context(khs, signatories, today_date):
+    khs_scores = [score for score in khs.nilai_list.all()]
+    status = 'LULUS' if khs.ips > 2 else 'TIDAK LULUS'
 
-    context = {
+    return {
         'khs_scores': khs_scores,
-        'sks_total': sks_total,
+        'sks_total': khs.total_sks,
         'tahun_akademik': f'{khs.tahun_akademik_awal}/{khs.tahun_akademik_akhir}',
-        'nilai_mutu_total': quality_value_total,
-        'ips': ips,
+        'nilai_mutu_total': khs.total_nilai_mutu,
+        'ips': khs.ips,
         'mahasiswa': khs.mahasiswa,
         'kelas': khs.kelas,
         'semester': khs.semester,
@@ -50,9 +113,308 @@ def print_khs(request, khs_id):
         'program_pendidikan': khs.program_pendidikan,
         'status': status,
         'today_date': today_date,
-        'ketua_jurusan': ketua_jurusan,
-        'koordinator_prodi': koordinator_prodi
+        **signatories
     }
 
-    return render(request, 'khs.html', context)
 
+def get_ips(total_nilai_mutu, total_sks):
+    return Decimal(str(round(total_nilai_mutu / total_sks, 2))) if total_sks else Decimal('0')
+
+
+def refresh_khs_totals(khs_ids):
+    '''
+    Recalculates the stored IPS, SKS, 'nilai mutu' and course count of the given 'KHS'
+    with one aggregate query over their 'NilaiKHS' rows. The IPS is SKS-weighted, the 'nilai mutu'
+    total divided by the SKS total, like the IPK of 'get_transkrip'.
+    '''
+    sks = F('mata_kuliah__jumlah_sks_teori') + F('mata_kuliah__jumlah_sks_praktik')
+    totals = {
+        total['khs_id']: total for total in models.NilaiKHS.objects
+            .filter(khs_id__in=khs_ids)
+            .values('khs_id')
+            .annotate(
+                total_sks=Sum(sks),
+                total_nilai_mutu=Sum(F('angka_mutu') * sks),
+                jumlah_mata_kuliah=Count('id')
+            )
+    }
+    khs_list = list(models.KHS.objects.filter(id__in=khs_ids).only('id'))
+    for khs in khs_list:
+        total = totals.get(khs.id)
+        khs.ips = get_ips(total['total_nilai_mutu'], total['total_sks']) if total else 0
+        khs.total_sks = total['total_sks'] if total else 0
+        khs.total_nilai_mutu = total['total_nilai_mutu'] if total else 0
+        khs.jumlah_mata_kuliah = total['jumlah_mata_kuliah'] if total else 0
+    models.KHS.objects.bulk_update(khs_list, ['ips', 'total_sks', 'total_nilai_mutu', 'jumlah_mata_kuliah'])
+
+
+def get_transkrip(mahasiswa):
+    '''
+    Builds the transcript of a 'mahasiswa': the IPS of every 'KHS' and the cumulative IPK.
+    The IPS is the one stored on the 'KHS', the IPK is SKS-weighted like it and aggregated by the
+    database, so it takes two queries however many semesters the 'mahasiswa' has.
+    '''
+    sks = F('mata_kuliah__jumlah_sks_teori') + F('mata_kuliah__jumlah_sks_praktik')
+    totals = {
+        'total_sks': Sum(sks),
+        'total_nilai_mutu': Sum(F('angka_mutu') * sks),
+    }
+    nilai_list = models.NilaiKHS.objects.filter(khs__mahasiswa=mahasiswa)
+    semester_list = nilai_list\
+        .values('khs_id', 'khs__semester', 'khs__tahun_akademik_awal', 'khs__tahun_akademik_akhir', 'khs__ips')\
+        .annotate(**totals)\
+        .order_by('khs__semester', 'khs__tahun_akademik_awal')
+    total = nilai_list.aggregate(
+        indeks_prestasi=Cast(Sum(F('angka_mutu') * sks), FloatField()) / NullIf(Sum(sks), 0),
+        **totals
+    )
+
+    return {
+        'nim': mahasiswa.nim,
+        'semester_list': [
+            {
+                'khs_id': semester['khs_id'],
+                'semester': semester['khs__semester'],
+                'tahun_akademik': f"{semester['khs__tahun_akademik_awal']} / {semester['khs__tahun_akademik_akhir']}",
+                'total_sks': semester['total_sks'],
+                'total_nilai_mutu': semester['total_nilai_mutu'],
+                'ips': float(semester['khs__ips'])
+            } for semester in semester_list
+        ],
+        'total_sks': total['total_sks'] or 0,
+        'total_nilai_mutu': total['total_nilai_mutu'] or 0,
+        'ipk': round(total['indeks_prestasi'] or 0, 2)
+    }
+
+
+def generate_khs(kelas_ids, tahun_akademik_awal, tahun_akademik_akhir):
+    '''
+    Creates the 'KHS' of every 'mahasiswa' in the given 'kelas' for an academic year. The students
+    are snapshotted with one joined query and the 'KHS' are written with one 'bulk_create'.
+    Students that already have a 'KHS' for the year and their current semester are skipped, so
+    running it again only creates the missing ones. Returns the number of 'KHS' this call created.
+    '''
+    mahasiswa_list = list(models.Mahasiswa.objects\
+        .filter(kelas_id__in=kelas_ids)\
+        .values('id', 'kelas__huruf', 'kelas__semester_id', 'kelas__prodi__nama',
+                'kelas__prodi__program_pendidikan__nama', 'pembimbing_akademik__nama',
+                'pembimbing_akademik__gelar'))
+    existing_khs = models.KHS.objects.filter(
+        mahasiswa_id__in=[mahasiswa['id'] for mahasiswa in mahasiswa_list],
+        tahun_akademik_awal=tahun_akademik_awal
+    )
+
+    candidates = []
+    for mahasiswa in mahasiswa_list:
+        dosen_pembimbing = ''
+        if mahasiswa['pembimbing_akademik__nama']:
+            dosen_pembimbing = f"{mahasiswa['pembimbing_akademik__nama']} {mahasiswa['pembimbing_akademik__gelar']}"
+        candidates.append(models.KHS(
+            semester=mahasiswa['kelas__semester_id'],
+            program_studi=mahasiswa['kelas__prodi__nama'],
+            program_pendidikan=mahasiswa['kelas__prodi__program_pendidikan__nama'],
+            tahun_akademik_awal=tahun_akademik_awal,
+            tahun_akademik_akhir=tahun_akademik_akhir,
+            dosen_pembimbing=dosen_pembimbing,
+            kelas=mahasiswa['kelas__huruf'],
+            mahasiswa_id=mahasiswa['id']
+        ))
+
+    existing_keys = set(existing_khs.values_list('mahasiswa_id', 'semester'))
+    while True:
+        khs_list = [khs for khs in candidates if (khs.mahasiswa_id, khs.semester) not in existing_keys]
+        try:
+            with transaction.atomic():
+                return len(models.KHS.objects.bulk_create(khs_list, batch_size=500))
+        except IntegrityError:
+            # Another run created some of these 'KHS' meanwhile, the unique constraint rejected the
+            # whole batch, so it is written again without them
+            keys = set(existing_khs.values_list('mahasiswa_id', 'semester'))
+            if keys == existing_keys:
+                raise
+            existing_keys = keys
+
+
+def get_print_khs_context(khs_id, today_date=None, signatories=None):
+    khs = models.KHS.objects\
+        .select_related('mahasiswa__user', 'mahasiswa__pembimbing_akademik')\
+        .prefetch_related('nilai_list__mata_kuliah')\
+        .filter(pk=khs_id)\
+        .first()
+    if khs is None:
+        raise Http404
+    if signatories is None:
+        signatories = signatory_cache.get(khs.program_studi)
+    context = get_khs_context(khs, signatories, today_date or get_today_date())
+    context['title'] = f'{khs.mahasiswa.nama_depan()} {khs.mahasiswa.nama_belakang()} ' \
+                       f'{khs.program_studi} {khs.semester} {khs.kelas}'
+    return context
+
+
+def print_khs(request, khs_id):
+    return render(request, 'khs.html', get_print_khs_context(khs_id))
+
+
+def get_khs_content_hash(khs_id, today_date):
+    '''
+    Hashes everything the printed 'KHS' shows: its header, the 'mahasiswa', the scores, the
+    signatories and the print date. Returns the hash and the signatories, so the render can reuse
+    them, or (None, None) when there is no such 'KHS'.
+    '''
+    khs = models.KHS.objects\
+        .filter(pk=khs_id)\
+        .values('semester', 'program_studi', 'program_pendidikan', 'tahun_akademik_awal', 'tahun_akademik_akhir',
+                'kelas', 'ips', 'total_sks', 'total_nilai_mutu', 'mahasiswa__nim', 'mahasiswa__user__first_name',
+                'mahasiswa__user__last_name', 'mahasiswa__pembimbing_akademik__nama',
+                'mahasiswa__pembimbing_akademik__gelar')\
+        .first()
+    if khs is None:
+        return None, None
+    signatories = signatory_cache.get(khs['program_studi'])
+    nilai_list = models.NilaiKHS.objects\
+        .filter(khs_id=khs_id)\
+        .order_by('id')\
+        .values_list('id', 'nilai', 'huruf_mutu', 'angka_mutu', 'mata_kuliah__nama',
+                     'mata_kuliah__jumlah_sks_teori', 'mata_kuliah__jumlah_sks_praktik')
+    content = [
+        today_date,
+        sorted(khs.items()),
+        [signatories[name] for name in ['jurusan', 'ketua_jurusan', 'koordinator_prodi']],
+        list(nilai_list)
+    ]
+    return hashlib.sha256(repr(content).encode()).hexdigest()[:16], signatories
+
+
+def get_khs_pdf_path(khs_id, content_hash):
+    return os.path.join(settings.KHS_PDF_CACHE_DIR, f'khs-{khs_id}-{content_hash}.pdf')
+
+
+def invalidate_khs_pdf_cache(khs_id, keep=None):
+    for path in glob(os.path.join(settings.KHS_PDF_CACHE_DIR, f'khs-{khs_id}-*.pdf')):
+        if path == keep:
+            continue
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def link_callback(uri, rel):
+    ''' Resolves the static files referenced by the template to local paths for xhtml2pdf. '''
+    for prefix in [settings.STATIC_URL, '../static/']:
+        if uri.startswith(prefix):
+            path = finders.find(uri[len(prefix):])
+            if path:
+                return path
+    return uri
+
+
+def print_khs_pdf(request, khs_id):
+    '''
+    Renders the 'KHS' as a PDF file. The result is cached on disk, outside the public media
+    directory, keyed by the 'KHS' id and a hash of everything it shows, so it is rendered again
+    after a score, the header or a signatory changes. The signing date is the print date, so it is
+    part of the hash too and a 'KHS' is rendered at most once a day, the file of the day before
+    is removed then.
+    '''
+    today_date = get_today_date()
+    content_hash, signatories = get_khs_content_hash(khs_id, today_date)
+    if content_hash is None:
+        raise Http404
+    path = get_khs_pdf_path(khs_id, content_hash)
+    if not os.path.exists(path):
+        context = get_print_khs_context(khs_id, today_date, signatories)
+        context['pdf'] = True
+        html = render_to_string('khs.html', context, request)
+
+        os.makedirs(settings.KHS_PDF_CACHE_DIR, exist_ok=True)
+        temp_path = f'{path}.{os.getpid()}.tmp'
+        try:
+            with open(temp_path, 'wb') as file:
+                result = pisa.CreatePDF(html, dest=file, link_callback=link_callback)
+            if result.err:
+                return HttpResponse('Failed to render the KHS', status=500)
+            os.replace(temp_path, path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        # The older renders of this 'KHS' can't be served anymore
+        invalidate_khs_pdf_cache(khs_id, keep=path)
+
+    return FileResponse(open(path, 'rb'), filename=f'khs-{khs_id}.pdf', content_type='application/pdf')
+
+
+def print_khs_kelas(request, kelas_id, semester=None, prodi_id=None):
+    '''
+    Prints the 'KHS' of every 'mahasiswa' in a 'kelas' as one document. The 'KHS' and the scores
+    are loaded with a fixed number of queries no matter how many students the 'kelas' has, the
+    signatories come from 'signatory_cache', and the document is streamed one page at a time.
+    With 'prodi_id' only a 'kelas' of that 'program studi' is found.
+    '''
+    kelas_list = models.Kelas.objects.select_related('prodi')
+    if prodi_id is not None:
+        kelas_list = kelas_list.filter(prodi_id=prodi_id)
+    kelas = get_object_or_404(kelas_list, pk=kelas_id)
+    semester = semester or kelas.semester_id
+    khs_list = models.KHS.objects\
+        .select_related('mahasiswa__user', 'mahasiswa__pembimbing_akademik')\
+        .prefetch_related('nilai_list__mata_kuliah')\
+        .filter(mahasiswa__kelas_id=kelas_id, semester=semester)\
+        .order_by('mahasiswa__nim')
+
+    header = get_template('khs_header.html')
+    page = get_template('khs_page.html')
+    footer = get_template('khs_footer.html')
+    today_date = get_today_date()
+
+    # The signatories are read from the cache once per 'program studi', not once per page
+    signatory_list = {}
+
+    def render_pages():
+        yield header.render({'title': f'KHS {kelas} Semester {semester}'}, request)
+        for khs in khs_list:
+            if khs.program_studi not in signatory_list:
+                signatory_list[khs.program_studi] = signatory_cache.get(khs.program_studi)
+            context = get_khs_context(khs, signatory_list[khs.program_studi], today_date)
+            yield page.render(context, request)
+        yield footer.render({}, request)
+
+    return StreamingHttpResponse(render_pages(), content_type='text/html')
+
+
+def escape_ics(value):
+    return str(value).replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\n', '\\n')
+
+
+def get_jadwal_ics(dosen, jadwal_makul_list):
+    '''
+    Builds an iCalendar file with one weekly event per 'JadwalMakul'. The first occurrence is the
+    matching day of the current week, and the times are floating (local) times like in the timetable.
+    '''
+    days = [hari for hari, nama in models.JadwalMakul.HARI_CHOICES]
+    today = datetime.today().date()
+    monday = today - timedelta(days=today.weekday())
+    lines = [
+        'BEGIN:VCALENDAR',
+        'VERSION:2.0',
+        'PRODID:-//SIAKAD//Jadwal Dosen//ID',
+        'CALSCALE:GREGORIAN',
+        f'X-WR-CALNAME:{escape_ics(f"Jadwal {dosen.nama}")}',
+    ]
+    for jadwal_makul in jadwal_makul_list:
+        date = monday + timedelta(days=days.index(jadwal_makul.hari))
+        kelas = jadwal_makul.jadwal.kelas
+        lines += [
+            'BEGIN:VEVENT',
+            f'UID:jadwal-makul-{jadwal_makul.id}@siakad',
+            f'DTSTAMP:{jadwal_makul.tanggal_diperbarui.astimezone(timezone.utc):%Y%m%dT%H%M%SZ}',
+            f'DTSTART:{datetime.combine(date, jadwal_makul.jam_mulai):%Y%m%dT%H%M%S}',
+            f'DTEND:{datetime.combine(date, jadwal_makul.jam_selesai):%Y%m%dT%H%M%S}',
+            'RRULE:FREQ=WEEKLY',
+            f'SUMMARY:{escape_ics(jadwal_makul.mata_kuliah.nama)}',
+            f'LOCATION:{escape_ics(f"{jadwal_makul.ruangan.gedung.nama} {jadwal_makul.ruangan.nama}")}',
+            f'DESCRIPTION:{escape_ics(f"Kelas {kelas.prodi.nama} {kelas.semester_id} {kelas.huruf}")}',
+            'END:VEVENT',
+        ]
+    lines.append('END:VCALENDAR')
+    return '\r\n'.join(lines) + '\r\n'
@@ -1,16 +1,30 @@
 from datetime import datetime
+import hashlib
 from django.db import IntegrityError
+from django.db.models import Count, Prefetch, Q
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
 from django.views.generic import View
-from django.http.response import HttpResponse
+from django.http import Http404
+from django.http.response import HttpResponse, HttpResponseBadRequest, HttpResponseForbidden
 from django.shortcuts import render
 from rest_framework import status
+from rest_framework.filters import OrderingFilter
+from rest_framework.generics import get_object_or_404
 from rest_framework.response import Response
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.viewsets import ModelViewSet
 from rest_framework.decorators import action
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
 
-from . import models, serializers, permissions
-from .utils import print_khs
+from . import jadwal_cache, models, serializers, pagination, permissions, scheduling, timetable
+from .occupancy import occupancy_cache
+from .readers import DosenReader, FastReadMixin, MahasiswaReader
+from .search import SEARCH_LIMIT, search_mahasiswa
+from .utilization import get_utilisasi_gedung
+from .utils import get_jadwal_ics, get_transkrip, print_khs, print_khs_kelas, print_khs_pdf
 
 
 class JurusanViewSet(ModelViewSet):
@@ -41,7 +55,13 @@ class GedungKuliahViewSet(ModelViewSet):
     queryset = models.GedungKuliah.objects.all()
     serializer_class = serializers.GedungKuliahSerializer
 
+    @action(detail=True, methods=['GET'])
+    def utilisasi(self, request, pk=None):
+        return Response(get_utilisasi_gedung(self.get_object()), status=status.HTTP_200_OK)
+
     def get_permissions(self):
+        if self.action == 'utilisasi':
+            return [permissions.IsUptTIK()]
         return [AllowAny()] if self.request.method == 'GET' else [permissions.IsUptTIK()]
     
 
@@ -78,7 +98,7 @@ class ProgramStudiViewSet(ModelViewSet):
 
 
 class StaffProdiViewSet(ModelViewSet):
-    queryset = models.StaffProdi.objects.select_related('prodi', 'user').all()
+    queryset = models.StaffProdi.objects.select_related('prodi').with_user_fields()
     lookup_field = 'no_induk'
     
     def get_serializer_class(self):
@@ -99,12 +119,46 @@ class StaffProdiViewSet(ModelViewSet):
         return Response(serializer.data, status=status.HTTP_201_CREATED)
     
 
-class DosenViewSet(ModelViewSet):
-    queryset = models.Dosen.objects\
-        .select_related('prodi')\
-        .prefetch_related('makul_ajar__mata_kuliah', 'makul_ajar__ruangan__gedung')\
-        .all()
+# Everything the JSON and the iCalendar 'jadwal' of a 'dosen' show
+DOSEN_JADWAL_VALUES = [
+    'id', 'hari', 'jam_mulai', 'jam_selesai', 'tanggal_diperbarui', 'dosen__nama',
+    'ruangan__nama', 'ruangan__gedung__nama',
+    'mata_kuliah__kode', 'mata_kuliah__nama', 'mata_kuliah__jumlah_sks_teori', 'mata_kuliah__jumlah_sks_praktik',
+    'jadwal_id', 'jadwal__kelas__semester_id', 'jadwal__kelas__huruf', 'jadwal__kelas__prodi__nama',
+]
+
+
+def get_dosen_jadwal_etag(request, nip=None):
+    '''
+    Hashes the values the 'jadwal' shows with one query, so a deleted 'JadwalMakul' or a renamed
+    'ruangan' or 'mata_kuliah' changes the ETag too, and a matching one skips building the response.
+    '''
+    rows = models.JadwalMakul.objects\
+        .filter(dosen__nip=nip)\
+        .order_by('id')\
+        .values_list(*DOSEN_JADWAL_VALUES)
+    return hashlib.sha256(repr([request.path, list(rows)]).encode()).hexdigest()[:32]
+
+
+class DosenViewSet(FastReadMixin, ModelViewSet):
     lookup_field = 'nip'
+    fast_read_class = DosenReader
+
+    def get_queryset(self):
+        queryset = models.Dosen.objects.all()
+        if self.action not in ['list', 'retrieve']:
+            return queryset
+        serializer_class = serializers.DosenSerializer
+        if serializer_class.is_expanded(self.request, 'prodi'):
+            queryset = queryset.select_related('prodi')
+        if serializer_class.is_expanded(self.request, 'makul_ajar'):
+            queryset = queryset.prefetch_related(Prefetch(
+                'makul_ajar',
+                queryset=models.JadwalMakul.objects.select_related('mata_kuliah', 'ruangan__gedung', 'jadwal__kelas__semester')
+            ))
+        elif serializer_class.is_requested(self.request, 'makul_ajar'):
+            queryset = queryset.prefetch_related(Prefetch('makul_ajar', queryset=models.JadwalMakul.objects.only('id', 'dosen_id')))
+        return queryset
     
     def get_serializer_class(self):
         if self.request.method in ['POST', 'PUT']:
@@ -113,6 +167,28 @@ class DosenViewSet(ModelViewSet):
 
     def get_permissions(self):
         return [IsAuthenticated()] if self.request.method == 'GET' else [permissions.IsStaffProdi()]
+
+    def get_jadwal_makul_list(self, nip):
+        days = [hari for hari, nama in models.JadwalMakul.HARI_CHOICES]
+        queryset = models.JadwalMakul.objects\
+            .filter(dosen__nip=nip)\
+            .select_related('mata_kuliah', 'ruangan__gedung', 'jadwal__kelas__prodi', 'jadwal__kelas__semester')
+        return sorted(queryset, key=lambda jadwal_makul: (days.index(jadwal_makul.hari), jadwal_makul.jam_mulai))
+
+    @action(detail=True, methods=['GET'])
+    @method_decorator(condition(etag_func=get_dosen_jadwal_etag))
+    def jadwal(self, request, nip=None):
+        dosen = self.get_object()
+        serializer = serializers.DosenJadwalMakulSerializer(self.get_jadwal_makul_list(dosen.nip), many=True)
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+    @action(detail=True, methods=['GET'], url_path=r'jadwal\.ics', url_name='jadwal-ics')
+    @method_decorator(condition(etag_func=get_dosen_jadwal_etag))
+    def jadwal_ics(self, request, nip=None):
+        dosen = self.get_object()
+        response = HttpResponse(get_jadwal_ics(dosen, self.get_jadwal_makul_list(dosen.nip)), content_type='text/calendar; charset=utf-8')
+        response['Content-Disposition'] = f'inline; filename="jadwal-{dosen.nip}.ics"'
+        return response
     
 
 class KelasViewSet(ModelViewSet):
@@ -129,18 +205,25 @@ class KelasViewSet(ModelViewSet):
         return [AllowAny()] if self.request.method == 'GET' else [permissions.IsStaffProdi()]
     
 
-class MahasiswaViewSet(ModelViewSet):
-    queryset = models.Mahasiswa.objects\
-        .select_related(
-            'pembimbing_akademik', 
-            'kelas', 
-            'kelas__prodi', 
-            'kelas__prodi__jurusan', 
-            'kelas__semester', 
-            'user',
-        )\
-        .all()
+class MahasiswaViewSet(FastReadMixin, ModelViewSet):
     lookup_field = 'nim'
+    fast_read_class = MahasiswaReader
+
+    def get_queryset(self):
+        queryset = models.Mahasiswa.objects.all()
+        if self.action not in ['list', 'retrieve']:
+            return queryset
+        # Only join what the requested '?fields=' and '?expand=' render
+        serializer_class = serializers.MahasiswaSerializer
+        related = []
+        if any(serializer_class.is_requested(self.request, field) for field in ['nama_depan', 'nama_belakang', 'username', 'email']):
+            queryset = queryset.with_user_fields()
+        if serializer_class.is_expanded(self.request, 'kelas'):
+            related += ['kelas__prodi__jurusan', 'kelas__prodi__program_pendidikan']
+        if serializer_class.is_expanded(self.request, 'pembimbing_akademik'):
+            related.append('pembimbing_akademik')
+        # 'select_related()' without fields would follow every foreign key, the user included
+        return queryset.select_related(*related) if related else queryset
 
     @action(detail=False, methods=['GET', 'PUT'])
     def me(self, request):
@@ -153,6 +236,34 @@ class MahasiswaViewSet(ModelViewSet):
             serializer.is_valid(raise_exception=True)
             serializer.save()
             return Response(serializer.data, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['GET'], url_path='me/jadwal', url_name='me-jadwal')
+    def me_jadwal(self, request):
+        # The 'kelas' and the timetable come from the cache, so a cache hit only queries the user
+        kelas_id = jadwal_cache.get_mahasiswa_kelas_id(request.user.id)
+        if kelas_id is None:
+            return Response({'detail': 'The user is not a mahasiswa'}, status=status.HTTP_403_FORBIDDEN)
+        hari = request.GET.get('hari')
+        if not hari:
+            weekday = datetime.today().weekday()
+            if weekday >= len(jadwal_cache.DAYS):
+                return Response([], status=status.HTTP_200_OK)
+            hari = jadwal_cache.DAYS[weekday]
+        if hari not in jadwal_cache.DAYS:
+            return Response({'hari': [f'"{hari}" is not a valid choice.']}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(jadwal_cache.get_jadwal_kelas(kelas_id, hari), status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['GET'])
+    def cari(self, request):
+        # Returns at most 'SEARCH_LIMIT' ranked rows, so there are no pages
+        q = request.GET.get('q', '').strip()
+        reader = MahasiswaReader(request)
+        queryset = reader.get_queryset(search_mahasiswa(q))[:SEARCH_LIMIT]
+        return Response(reader.to_representation(queryset), status=status.HTTP_200_OK)
+
+    @action(detail=True, methods=['GET'])
+    def transkrip(self, request, nim=None):
+        return Response(get_transkrip(self.get_object()), status=status.HTTP_200_OK)
                 
     def get_serializer_class(self):
         if self.request.method in ['POST', 'PUT', 'PATCH']:
@@ -162,26 +273,68 @@ class MahasiswaViewSet(ModelViewSet):
     def get_permissions(self):
         if self.action == 'me':
             return [permissions.IsMahasiswa()]
+        elif self.action == 'transkrip':
+            return [permissions.IsStaffProdiOrIsMahasiswa()]
+        elif self.action == 'me_jadwal':
+            return [IsAuthenticated()]
         elif self.request.method in ['PUT', 'PATCH']:
             return [permissions.IsStaffProdiOrIsMahasiswa()]
         return [permissions.IsStaffProdi()]
     
 
 class RuanganViewSet(ModelViewSet):
-    queryset = models.Ruangan.objects\
-        .select_related('gedung')\
-        .prefetch_related('jadwalmakul_set', 'jadwalmakul_set__dosen', 'jadwalmakul_set__mata_kuliah',
-                          'jadwalmakul_set__jadwal')\
-        .all()
     serializer_class = serializers.RuanganSerializer
 
-    def list(self, request, *args, **kwargs):
-        gedung_id = request.GET.get('gedung_id', '')
-        if (not gedung_id):
-            return super().list(request, *args, **kwargs)
-        queryset = self.get_queryset().filter(gedung_id=gedung_id)
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(data=serializer.data, status=status.HTTP_200_OK)
+    def is_summary(self):
+        return self.action == 'list' and self.request.GET.get('summary') == 'true'
+
+    def get_queryset(self):
+        queryset = models.Ruangan.objects.select_related('gedung')
+        if self.is_summary():
+            queryset = queryset.annotate(jumlah_jadwal=Count('jadwalmakul'))
+        elif self.request.method == 'GET':
+            queryset = queryset.prefetch_related(Prefetch(
+                'jadwalmakul_set',
+                queryset=models.JadwalMakul.objects.select_related('dosen', 'mata_kuliah', 'jadwal__kelas__prodi')
+            ))
+        gedung_id = self.request.GET.get('gedung_id', '')
+        if self.action == 'list' and gedung_id.isdigit():
+            queryset = queryset.filter(gedung_id=gedung_id)
+        return queryset.all()
+
+    def get_serializer_class(self):
+        if self.is_summary():
+            return serializers.SummaryRuanganSerializer
+        return serializers.RuanganSerializer
+
+    @action(detail=True, methods=['GET'])
+    def jadwal(self, request, pk=None):
+        ruangan = get_object_or_404(models.Ruangan.objects.only('id'), pk=pk)
+        days = [hari for hari, nama in models.JadwalMakul.HARI_CHOICES]
+        queryset = models.JadwalMakul.objects\
+            .filter(ruangan_id=ruangan.id)\
+            .select_related('dosen', 'mata_kuliah', 'jadwal__kelas__prodi', 'jadwal__kelas__semester')
+        # The day codes don't sort Monday to Friday, so the rows are sorted by the order of the choices
+        jadwal_makul_list = sorted(queryset, key=lambda jadwal_makul: (days.index(jadwal_makul.hari), jadwal_makul.jam_mulai))
+        serializer = serializers.SimpleJadwalMakulSerializer(jadwal_makul_list, many=True)
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['GET'])
+    def tersedia(self, request):
+        serializer = serializers.RuanganTersediaSerializer(data=request.GET)
+        serializer.is_valid(raise_exception=True)
+        params = serializer.validated_data
+        queryset = models.Ruangan.objects.select_related('gedung')
+        if 'gedung_id' in params:
+            queryset = queryset.filter(gedung_id=params['gedung_id'])
+        ruangan_list = list(queryset)
+        free_ids = set(occupancy_cache.get_free_rooms(
+            [ruangan.id for ruangan in ruangan_list], params['hari'], params['jam_mulai'], params['jam_selesai']
+        ))
+        serializer = serializers.SimpleRuanganSerializer(
+            [ruangan for ruangan in ruangan_list if ruangan.id in free_ids], many=True
+        )
+        return Response(serializer.data, status=status.HTTP_200_OK)
 
     def get_permissions(self):
         return [AllowAny()] if self.request.method == 'GET' else [permissions.IsUptTIK()]
@@ -259,7 +412,8 @@ class PemberitahuanJurusanViewSet(ModelViewSet):
 
 class KaryaIlmiahViewSet(ModelViewSet):
     queryset = models.KaryaIlmiah.objects\
-        .select_related('prodi', 'prodi__jurusan', 'prodi__program_pendidikan', 'mahasiswa', 'mahasiswa__user')\
+        .select_related('prodi', 'prodi__jurusan', 'prodi__program_pendidikan')\
+        .prefetch_related(Prefetch('mahasiswa', queryset=models.Mahasiswa.objects.with_user_fields()))\
         .all()
     serializer_class = serializers.KaryaIlmiahSerializer
     
@@ -295,9 +449,9 @@ class JadwalViewSet(ModelViewSet):
         if kelas_id:
             return queryset.filter(kelas_id=kelas_id)
         elif semesterType == 'even':
-            return queryset.filter(kelas__semester__in=[2, 4, 6, 8])
+            return queryset.filter(kelas__semester__ganjil=False)
         elif semesterType == 'odd':
-            return queryset.filter(kelas__semester__in=[1, 3, 5, 7])
+            return queryset.filter(kelas__semester__ganjil=True)
         return queryset.all()
     
     def get_serializer_class(self):
@@ -305,6 +459,20 @@ class JadwalViewSet(ModelViewSet):
             return serializers.CreateUpdateJadwalSerializer
         return serializers.JadwalSerializer
 
+    @action(detail=False, methods=['POST'])
+    def clone(self, request):
+        serializer = serializers.CloneJadwalSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        kelas_map, dosen_map, ruangan_map = serializer.get_maps()
+        try:
+            created = timetable.clone_jadwal(
+                kelas_map, dosen_map, ruangan_map,
+                serializer.validated_data['replace'], serializer.validated_data['move']
+            )
+        except ValueError as error:
+            return Response({'detail': str(error)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'created': len(created)}, status=status.HTTP_201_CREATED)
+
     def get_permissions(self):
         if self.request.method == 'GET':
             return [permissions.IsStaffProdiOrIsMahasiswa()]
@@ -327,7 +495,33 @@ class JadwalMakulViewSet(ModelViewSet):
         .select_related('dosen', 'mata_kuliah', 'ruangan__gedung')\
         .prefetch_related('materi_set')\
         .all()
-    serializer_class = serializers.JadwalMakulSerializer
+
+    def get_serializer_class(self):
+        if self.request.method in ['POST', 'PUT', 'PATCH']:
+            return serializers.CreateUpdateJadwalMakulSerializer
+        return serializers.JadwalMakulSerializer
+
+    @action(detail=False, methods=['GET'])
+    def konflik(self, request, jadwal_pk=None):
+        # Only the bookings of this 'jadwal' and the ones sharing a 'ruangan' or a 'dosen' on the same days
+        bookings = scheduling.load_bookings(models.JadwalMakul.objects.filter(jadwal_id=jadwal_pk))
+        jadwal_makul_ids = {booking['id'] for booking in bookings}
+        if bookings:
+            bookings += scheduling.load_bookings(
+                models.JadwalMakul.objects
+                    .filter(
+                        Q(ruangan_id__in={booking['ruangan_id'] for booking in bookings}) |
+                        Q(dosen_id__in={booking['dosen_id'] for booking in bookings if booking['dosen_id']}),
+                        hari__in={booking['hari'] for booking in bookings}
+                    )
+                    .exclude(jadwal_id=jadwal_pk)
+            )
+        conflicts = [
+            {**conflict, 'detail': scheduling.describe_conflict(conflict)}
+            for conflict in scheduling.audit(bookings)
+            if jadwal_makul_ids.intersection(conflict['jadwal_makul'])
+        ]
+        return Response(conflicts, status=status.HTTP_200_OK)
 
     def get_serializer_context(self):
         context = super().get_serializer_context()
@@ -342,14 +536,52 @@ class JadwalMakulViewSet(ModelViewSet):
 
 class KHSViewSet(ModelViewSet):
     http_method_names = ['get', 'post', 'delete']
-    queryset = models.KHS.objects\
-        .select_related('mahasiswa__user')\
-        .prefetch_related('nilai_list__mata_kuliah')\
-        .all()
+    filter_backends = [OrderingFilter]
+    ordering_fields = ['ips', 'semester', 'total_sks', 'tahun_akademik_awal']
+    ordering = ['-id']
+    pagination_class = pagination.StandardCursorPagination
+
+    def is_summary(self):
+        return self.action == 'list' and self.request.GET.get('summary') == 'true'
+
+    def get_queryset(self):
+        queryset = models.KHS.objects.prefetch_related(
+            Prefetch('mahasiswa', queryset=models.Mahasiswa.objects.with_user_fields())
+        )
+        if not self.is_summary():
+            queryset = queryset.prefetch_related('nilai_list__mata_kuliah')
+        if self.action != 'list':
+            return queryset.all()
+
+        nim = self.request.GET.get('nim')
+        kelas_id = self.request.GET.get('kelas_id', '')
+        prodi = self.request.GET.get('prodi')
+        if nim:
+            queryset = queryset.filter(mahasiswa__nim=nim)
+        if kelas_id.isdigit():
+            # The 'KHS' of a 'kelas' are matched on their snapshot columns, which the
+            # ('program_studi', 'semester', 'kelas') index covers
+            kelas = models.Kelas.objects.select_related('prodi').filter(pk=kelas_id).first()
+            if kelas is None:
+                return queryset.none()
+            queryset = queryset.filter(program_studi=kelas.prodi.nama, kelas=kelas.huruf)
+            if not self.request.GET.get('semester', '').isdigit():
+                queryset = queryset.filter(semester=kelas.semester_id)
+        if prodi:
+            queryset = queryset.filter(
+                program_studi__in=models.ProgramStudi.objects.filter(kode=prodi).values('nama')
+            )
+        for field in ['semester', 'tahun_akademik_awal', 'tahun_akademik_akhir']:
+            value = self.request.GET.get(field, '')
+            if value.isdigit():
+                queryset = queryset.filter(**{field: value})
+        return queryset.all()
 
     def get_serializer_class(self):
         if self.request.method == 'POST':
             return serializers.CreateKHSSerializer
+        elif self.is_summary():
+            return serializers.SimpleKHSSerializer
         return serializers.KHSSerializer
     
     def get_permissions(self):
@@ -357,23 +589,35 @@ class KHSViewSet(ModelViewSet):
             return [permissions.IsStaffProdiOrIsMahasiswa()]
         return [permissions.IsStaffProdi()]
     
-    def list(self, request, *args, **kwargs):
-        param_value = request.GET.get('nim', '')
-        if not param_value:
-            return super().list(request, *args, **kwargs)
-        queryset = models.KHS.objects.filter(mahasiswa__nim=param_value).all()
-        serializer = serializers.KHSSerializer(queryset, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
-    
     def create(self, request, *args, **kwargs):
         serializer = serializers.CreateKHSSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        khs = serializer.save()
+        try:
+            khs = serializer.save()
+        except IntegrityError:
+            return Response(
+                {'mahasiswa': ['This "mahasiswa" already has a "khs" for the semester and academic year']},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         serializer = serializers.KHSSerializer(khs)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=['POST'])
+    def bulk(self, request):
+        serializer = serializers.BulkCreateKHSSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return Response(serializer.save(), status=status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=['POST'])
+    def bulk_nilai(self, request):
+        serializer = serializers.BulkNilaiKHSSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return Response(serializer.save(), status=status.HTTP_200_OK)
     
 
 class NilaiKHSViewSet(ModelViewSet):
+    pagination_class = pagination.StandardCursorPagination
+
     def get_queryset(self):
         return models.NilaiKHS.objects.select_related('mata_kuliah').filter(khs_id=self.kwargs['khs_pk'])
     
@@ -416,21 +660,50 @@ class NilaiKHSViewSet(ModelViewSet):
     
 
 class MateriViewSet(ModelViewSet):
-    queryset = models.Materi.objects.select_related('jadwal_makul').all()
     serializer_class = serializers.MateriSerializer
+    # Newest first, the id follows 'tanggal_unggah'
+    pagination_class = pagination.StandardCursorPagination
+
+    def get_queryset(self):
+        queryset = models.Materi.objects.all()
+        jadwal_makul_id = self.request.GET.get('jadwal_makul_id', '')
+        if self.action == 'list' and jadwal_makul_id.isdigit():
+            queryset = queryset.filter(jadwal_makul_id=jadwal_makul_id)
+        return queryset
+
 
-    def list(self, request, *args, **kwargs):
-        jadwal_makul_id = self.request.GET.get('jadwal_makul_id')
-        if jadwal_makul_id:
-            queryset = models.Materi.objects.filter(jadwal_makul_id=jadwal_makul_id).order_by('-tanggal_unggah')
-            serializer = serializers.MateriSerializer(queryset, many=True)
-            return Response(data=serializer.data)
-        return super().list(request, *args, **kwargs)
+def get_print_user(request):
+    ''' The session user, or the user of the JWT header the API views read. '''
+    if request.user.is_authenticated:
+        return request.user
+    try:
+        result = JWTAuthentication().authenticate(request)
+    except (AuthenticationFailed, InvalidToken):
+        return None
+    return result[0] if result else None
 
 
 class GeneratePdf(View):
     def get(self, request, *args, **kwargs):
         model = request.GET.get('model')
         if (model == 'khs'):
-            khs_id = request.GET.get('khs_id')
+            kelas_id = request.GET.get('kelas')
+            if kelas_id:
+                # The whole 'kelas' shows the grades of every student, only its staff prodi prints it
+                user = get_print_user(request)
+                if user is None:
+                    return HttpResponse('Authentication credentials were not provided.', status=401)
+                if not hasattr(user, permissions.staff_prodi):
+                    return HttpResponseForbidden('Only the staff prodi can print the KHS of a kelas.')
+                semester = request.GET.get('semester', '')
+                if not kelas_id.isdigit():
+                    raise Http404
+                if semester and not semester.isdigit():
+                    return HttpResponseBadRequest('"semester" must be a number.')
+                return print_khs_kelas(request, kelas_id, semester or None, user.staffprodi.prodi_id)
+            khs_id = request.GET.get('khs_id', '')
+            if not khs_id.isdigit():
+                raise Http404
+            if request.GET.get('format') == 'pdf':
+                return print_khs_pdf(request, khs_id)
             return print_khs(request, khs_id)
\ No newline at end of file
@@ -131,11 +131,38 @@ INTERNAL_IPS = [
 MEDIA_URL = 'media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media/')
 
+# Rendered grade reports, kept out of MEDIA_ROOT so they aren't publicly served
+KHS_PDF_CACHE_DIR = os.path.join(BASE_DIR, 'cache/khs/')
+
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'rest_framework_simplejwt.authentication.JWTAuthentication',
-    )
+    ),
+    'DEFAULT_PAGINATION_CLASS': 'academic.pagination.StandardPageNumberPagination',
+    'PAGE_SIZE': 50
+}
+
+# Shared by every worker through Redis, so invalidating a cached timetable, report or signatory
+# list in one of them reaches the others. Without REDIS_URL every process keeps its own cache,
+# which is only right for a single development server. The print template fragments stay in the
+# memory of each process, their keys carry the shared signatory version.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'templates': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'templates',
+    }
 }
+if os.environ.get('REDIS_URL'):
+    CACHES['default'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ['REDIS_URL'],
+    }
+
+# The largest 'page_size' a client can ask for
+API_MAX_PAGE_SIZE = 200
 
 SIMPLE_JWT = {
     'AUTH_HEADER_TYPES': ('JWT', ),